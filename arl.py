@@ -7,12 +7,18 @@
 # 3. Issuance of Association Rules
 # 4. Preparing the Script of the Work
 # 5. Making Product Recommendations to Users in the Cart Stage
+# 6. Frequent Itemset Mining with Vertical Bitsets (Eclat)
+# 7. Rules for All Countries in Parallel
+# 8. Indexed Rule Lookup
+# 9. Recommendations for a Whole Cart
 
 ############################################
 # 1. Data Preprocessing
 ############################################
 
 # !pip install mlxtend
+import time
+import numpy as np
 import pandas as pd
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 500)
@@ -246,36 +252,18 @@ sort_values("confidence", ascending=False)
 # 4. Preparing the Script of the Study
 ############################################
 
-def outlier_thresholds(dataframe, variable):
-    quartile1 = dataframe[variable].quantile(0.01)
-    quartile3 = dataframe[variable].quantile(0.99)
-    interquantile_range = quartile3 - quartile1
-    up_limit = quartile3 + 1.5 * interquantile_range
-    low_limit = quartile1 - 1.5 * interquantile_range
-    return low_limit, up_limit
-
-def replace_with_thresholds(dataframe, variable):
-    low_limit, up_limit = outlier_thresholds(dataframe, variable)
-    dataframe.loc[(dataframe[variable] < low_limit), variable] = low_limit
-    dataframe.loc[(dataframe[variable] > up_limit), variable] = up_limit
+# The cleaning functions of section 1 are also used by the batch job in basket_rules.py (section 7).
+from basket_rules import retail_data_prep
 
-def retail_data_prep(dataframe):
-    dataframe.dropna(inplace=True)
-    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
-    dataframe = dataframe[dataframe["Quantity"] > 0]
-    dataframe = dataframe[dataframe["Price"] > 0]
-    replace_with_thresholds(dataframe, "Quantity")
-    replace_with_thresholds(dataframe, "Price")
-    return dataframe
 
+# groupby().sum().unstack().fillna(0).applymap(...) builds a dense float frame and runs a Python lambda on every
+# invoice x product cell. invoice_product_matrix (basket_rules.py) factorizes Invoice and StockCode / Description
+# to integer codes and builds the sparse boolean invoice x product matrix directly (duplicate rows are summed, as in
+# the groupby).
+# create_invoice_product_df(..., sparse=True) hands it to apriori as a sparse DataFrame, pack_columns turns it
+# into vertical bitsets (one row of uint64 words per product) for a bitset miner.
 
-def create_invoice_product_df(dataframe, id=False):
-    if id:
-        return dataframe.groupby(['Invoice', "StockCode"])['Quantity'].sum().unstack().fillna(0). \
-            applymap(lambda x: 1 if x > 0 else 0)
-    else:
-        return dataframe.groupby(['Invoice', 'Description'])['Quantity'].sum().unstack().fillna(0). \
-            applymap(lambda x: 1 if x > 0 else 0)
+from basket_rules import create_invoice_product_df
 
 
 def check_id(dataframe, stock_code):
@@ -337,6 +325,9 @@ check_id(df, 22326)
 # ['ROUND SNACK BOXES SET OF4 WOODLAND ']
 
 def arl_recommender(rules_df, product_id, rec_count=1):
+    # Prebuilt RuleIndex (section 8): no sort or scan per request
+    if hasattr(rules_df, "recommend"):
+        return rules_df.recommend(product_id, rec_count)
     sorted_rules = rules_df.sort_values("lift", ascending=False)
     recommendation_list = []
     for i, product in enumerate(sorted_rules["antecedents"]):
@@ -358,3 +349,211 @@ arl_recommender(rules, 22492, 3)
 
 
 
+
+
+############################################
+# 6. Frequent Itemset Mining with Vertical Bitsets (Eclat)
+############################################
+
+# apriori works on the dense one-hot frame and generates candidates level by level, which blows up in memory and
+# time on the whole United Kingdom basket set. eclat (basket_rules.py) keeps one bitset per product (pack_columns):
+# the invoices containing an itemset are the AND of its products' bitsets and its support is a popcount.
+# The search is depth first: the bitset of an itemset is intersected with all the remaining frequent
+# products at once, and only the frequent extensions are explored further.
+# eclat takes the same arguments as apriori and returns the same (support, itemsets) frame for association_rules.
+
+from basket_rules import country_min_support, eclat
+
+
+def create_rules(dataframe, id=True, country="France", miner=eclat):
+    dataframe = dataframe[dataframe['Country'] == country]
+    dataframe = create_invoice_product_df(dataframe, id, sparse=True)
+    frequent_itemsets = miner(dataframe, min_support=0.01, use_colnames=True)
+    rules = association_rules(frequent_itemsets, metric="support", min_threshold=0.01)
+    return rules
+
+
+def benchmark_miners(dataframe, id=True, min_support=0.01, min_count=5, max_len=4, countries=None):
+    # apriori vs eclat on every country's basket set: run time and whether the frequent itemsets agree.
+    # Every country is mined with country_min_support (min_support with a floor of min_count invoices, see
+    # section 7); countries with fewer than min_count invoices are listed with skipped=True.
+    results = []
+    invoice_counts = dataframe.groupby("Country")["Invoice"].nunique()
+    countries = invoice_counts.index if countries is None else countries
+    for country in countries:
+        n_invoices = invoice_counts.get(country, 0)
+        if n_invoices < min_count:
+            results.append({"country": country, "invoices": n_invoices, "skipped": True})
+            continue
+        country_support = country_min_support(n_invoices, min_support, min_count)
+        inv_pro_df = create_invoice_product_df(dataframe[dataframe["Country"] == country], id)
+        timings, itemsets = {}, {}
+        for name, miner in [("apriori", apriori), ("eclat", eclat)]:
+            start = time.time()
+            frequent_itemsets = miner(inv_pro_df, min_support=country_support, use_colnames=True, max_len=max_len)
+            timings[name] = time.time() - start
+            itemsets[name] = dict(zip(frequent_itemsets["itemsets"], frequent_itemsets["support"]))
+        same = itemsets["apriori"].keys() == itemsets["eclat"].keys() and \
+            all(np.isclose(support, itemsets["eclat"][itemset]) for itemset, support in itemsets["apriori"].items())
+        results.append({"country": country,
+                        "invoices": inv_pro_df.shape[0],
+                        "products": inv_pro_df.shape[1],
+                        "min_support": country_support,
+                        "itemsets": len(itemsets["eclat"]),
+                        "apriori_s": timings["apriori"],
+                        "eclat_s": timings["eclat"],
+                        "same_itemsets": same,
+                        "skipped": False})
+    return pd.DataFrame(results).sort_values("invoices", ascending=False)
+
+
+frequent_itemsets = eclat(create_invoice_product_df(df[df['Country'] == "France"], id=True, sparse=True),
+                          min_support=0.01, use_colnames=True)
+
+frequent_itemsets.shape
+# (40655, 2)
+
+rules = create_rules(df)
+
+benchmark_miners(df, min_count=5, max_len=4)
+
+
+############################################
+# 7. Rules for All Countries in Parallel
+############################################
+
+# create_rules filters the whole cleaned frame for one country per call. create_rules_by_country splits the
+# transactions by country in a single groupby, mines every country in its own worker process and returns
+# {country: rules}. The rules of every country are cached
+# (cache_dir/rules_<country>_<id>_<min_support>_<min_count>_<max_len>.pkl, written to a temporary file first and
+# then renamed); cached countries are not mined again. The rules hold frozensets, so the cache is a pickle.
+# min_support is relative: in a country with a few dozen invoices a single large basket is frequent on its own and
+# yields 2^basket size itemsets. Every country is mined with max(min_support, min_count / its invoice count)
+# (country_min_support), so an itemset needs at least min_count invoices, and itemsets are capped at max_len
+# products. Only countries with fewer than min_count invoices are skipped (and printed).
+
+# The job over all countries with a process pool runs from basket_rules.py, not from this script:
+#   python basket_rules.py
+# Spawn / forkserver workers (macOS, Windows, Python 3.14 on Linux) import the main module, so a pool started here
+# would re-read the Excel sheet and repeat every mining example above once per worker.
+# The job fills cache_dir; here the cached rules are loaded and any country missing from the cache is mined in
+# this process (n_jobs=1).
+from basket_rules import create_rules_by_country
+
+rules_by_country = create_rules_by_country(df, min_count=5, max_len=4, n_jobs=1)
+
+rules_by_country["France"].shape
+
+all_rules = pd.concat(rules_by_country, names=["Country", None])
+
+
+############################################
+# 8. Indexed Rule Lookup
+############################################
+
+# arl_recommender sorts all the rules by lift on every call and then walks every antecedent with sorted_rules.iloc.
+# RuleIndex does this once: the rules are sorted by lift, the first product of every consequent is extracted
+# into an array, and every antecedent product gets the positions of its rules (an inverted index stored as one
+# array with per-product offsets, in lift order). A recommendation is a dictionary lookup and an array slice.
+
+class RuleIndex:
+    def __init__(self, rules_df):
+        sorted_rules = rules_df.sort_values("lift", ascending=False, kind="stable")
+        self.consequents = np.array([list(consequents)[0] for consequents in sorted_rules["consequents"]],
+                                    dtype=object)
+        self.lift = sorted_rules["lift"].to_numpy()
+        self.confidence = sorted_rules["confidence"].to_numpy()
+        self.antecedent_sizes = sorted_rules["antecedents"].map(len).to_numpy(dtype=np.int64)
+        consequent_sizes = sorted_rules["consequents"].map(len).to_numpy(dtype=np.int64)
+        antecedent_products = [product for antecedents in sorted_rules["antecedents"] for product in antecedents]
+        consequent_products = [product for consequents in sorted_rules["consequents"] for product in consequents]
+        codes, self.products = pd.factorize(pd.Series(antecedent_products + consequent_products, dtype=object))
+        product_codes = codes[:len(antecedent_products)]
+        rule_ids = np.repeat(np.arange(len(sorted_rules)), self.antecedent_sizes)
+        # A stable sort keeps every product's rules in lift order
+        order = np.argsort(product_codes, kind="stable")
+        self.rule_ids = rule_ids[order]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(product_codes, minlength=len(self.products)))])
+        self.product_codes = {product: code for code, product in enumerate(self.products)}
+        # All consequent products: rule i has consequent_codes[consequent_offsets[i]:consequent_offsets[i + 1]]
+        self.consequent_codes = codes[len(antecedent_products):]
+        self.consequent_offsets = np.concatenate([[0], np.cumsum(consequent_sizes)])
+
+    def rules(self, product_id):
+        # Positions (in lift order) of the rules whose antecedents contain product_id
+        code = self.product_codes.get(product_id)
+        if code is None:
+            return self.rule_ids[:0]
+        return self.rule_ids[self.offsets[code]:self.offsets[code + 1]]
+
+    def recommend(self, product_id, rec_count=1):
+        return self.consequents[self.rules(product_id)[:rec_count]].tolist()
+
+    def recommend_basket(self, basket, rec_count=5, metric="lift"):
+        basket_codes = np.array([self.product_codes[product] for product in set(basket)
+                                 if product in self.product_codes], dtype=np.int64)
+        if len(basket_codes) == 0:
+            return []
+        # Rules touching the basket; the antecedents are a subset of the basket when all of their products hit
+        candidates = np.concatenate([self.rule_ids[self.offsets[code]:self.offsets[code + 1]]
+                                     for code in basket_codes])
+        rule_ids, hits = np.unique(candidates, return_counts=True)
+        matched = rule_ids[hits == self.antecedent_sizes[rule_ids]]
+        if len(matched) == 0:
+            return []
+        starts, ends = self.consequent_offsets[matched], self.consequent_offsets[matched + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        products = self.consequent_codes[positions]
+        scores = np.repeat(getattr(self, metric)[matched], lengths)
+        outside = ~np.isin(products, basket_codes)
+        products, scores = products[outside], scores[outside]
+        if len(products) == 0:
+            return []
+        # Every product once, with the best score of the rules recommending it
+        order = np.lexsort((-scores, products))
+        products, scores = products[order], scores[order]
+        first = np.concatenate([[True], products[1:] != products[:-1]])
+        products, scores = products[first], scores[first]
+        top = np.argsort(-scores, kind="stable")[:rec_count]
+        return self.products[products[top]].tolist()
+
+
+rule_index = RuleIndex(rules)
+
+arl_recommender(rule_index, 22492, 3)
+# [22556, 22551, 22326]
+
+rule_indexes = {country: RuleIndex(country_rules) for country, country_rules in rules_by_country.items()}
+
+arl_recommender(rule_indexes["Germany"], 22492, 3)
+
+
+############################################
+# 9. Recommendations for a Whole Cart
+############################################
+
+# arl_recommender takes a single product and only the first product of each consequent. A cart holds several
+# products: recommend_basket finds every rule whose antecedents are a subset of the cart through the inverted
+# index (a rule matches when each of its antecedent products is in the cart, i.e. its hit count equals its
+# antecedent size), so only the rules touching the cart are looked at, whatever the cart size.
+# All consequent products are merged, cart products dropped, and every product is ranked by the best
+# lift (or confidence) among the rules recommending it.
+
+cart = [22492, 21080, 21086, 22326]
+
+rule_index.recommend_basket(cart, rec_count=5)
+
+rule_index.recommend_basket(cart, rec_count=5, metric="confidence")
+
+[check_id(df, product_id) for product_id in rule_index.recommend_basket(cart, rec_count=3)]
+
+# A cart that no rule fully matches, or whose recommendations are all already in the cart, gets an empty list
+edge_index = RuleIndex(pd.DataFrame({"antecedents": [frozenset([1]), frozenset([5, 6]), frozenset([1, 5]),
+                                                     frozenset([1, 2])],
+                                     "consequents": [frozenset([5]), frozenset([1]), frozenset([6]), frozenset([4])],
+                                     "lift": [2.0, 3.0, 4.0, 5.0],
+                                     "confidence": [0.5, 0.6, 0.7, 0.8]}))
+
+edge_index.recommend_basket([4]), edge_index.recommend_basket([1, 5, 6]), edge_index.recommend_basket([1, 2])
+# ([], [], [4, 5])
@@ -0,0 +1,173 @@
+############################################
+# Basket Matrix and Rule Mining
+############################################
+
+# Shared by arl.py (sections 4, 6 and 7).
+# - retail_data_prep: the cleaning of arl.py section 1 (missing values, returns, outliers)
+# - invoice_product_matrix / create_invoice_product_df / pack_columns: the invoice x product matrix as a sparse
+#   boolean matrix, a (sparse) DataFrame for apriori or vertical bitsets
+# - eclat: bitset frequent itemset miner with apriori's arguments and output
+# - country_min_support: the relative min_support with an absolute floor of min_count invoices
+# - create_rules_by_country: rules of every country mined in a process pool
+# The pool job over all countries is started from this module (python basket_rules.py), which has no top-level
+# work of its own.
+
+# !pip install mlxtend
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from mlxtend.frequent_patterns import association_rules
+
+
+def outlier_thresholds(dataframe, variable):
+    quartile1 = dataframe[variable].quantile(0.01)
+    quartile3 = dataframe[variable].quantile(0.99)
+    interquantile_range = quartile3 - quartile1
+    up_limit = quartile3 + 1.5 * interquantile_range
+    low_limit = quartile1 - 1.5 * interquantile_range
+    return low_limit, up_limit
+
+def replace_with_thresholds(dataframe, variable):
+    low_limit, up_limit = outlier_thresholds(dataframe, variable)
+    dataframe.loc[(dataframe[variable] < low_limit), variable] = low_limit
+    dataframe.loc[(dataframe[variable] > up_limit), variable] = up_limit
+
+def retail_data_prep(dataframe):
+    dataframe.dropna(inplace=True)
+    dataframe = dataframe[~dataframe["Invoice"].str.contains("C", na=False)]
+    dataframe = dataframe[dataframe["Quantity"] > 0]
+    dataframe = dataframe[dataframe["Price"] > 0]
+    replace_with_thresholds(dataframe, "Quantity")
+    replace_with_thresholds(dataframe, "Price")
+    return dataframe
+
+
+def invoice_product_matrix(dataframe, id=False):
+    product_col = "StockCode" if id else "Description"
+    invoice_codes, invoices = pd.factorize(dataframe["Invoice"], sort=True)
+    product_codes, products = pd.factorize(dataframe[product_col], sort=True)
+    quantities = csr_matrix((dataframe["Quantity"].to_numpy(dtype=np.float64), (invoice_codes, product_codes)),
+                            shape=(len(invoices), len(products)))
+    return quantities > 0, invoices.rename("Invoice"), products.rename(product_col)
+
+
+def create_invoice_product_df(dataframe, id=False, sparse=False):
+    matrix, invoices, products = invoice_product_matrix(dataframe, id)
+    if sparse:
+        return pd.DataFrame.sparse.from_spmatrix(matrix, index=invoices, columns=products)
+    # Same 0 / 1 cells as the unstack version as one-byte bools, the input type apriori prefers
+    return pd.DataFrame(matrix.toarray(), index=invoices, columns=products)
+
+
+def pack_columns(matrix):
+    # Row p holds the invoices containing product p: bit i % 64 of word i // 64 is invoice i
+    matrix = matrix.tocsc()
+    matrix.eliminate_zeros()
+    n_invoices, n_products = matrix.shape
+    bits = np.zeros((n_products, (n_invoices + 63) // 64), dtype=np.uint64)
+    products = np.repeat(np.arange(n_products), np.diff(matrix.indptr))
+    invoices = matrix.indices.astype(np.uint64)
+    np.bitwise_or.at(bits, (products, invoices // np.uint64(64)), np.uint64(1) << (invoices % np.uint64(64)))
+    return bits
+
+
+def eclat(df, min_support=0.5, use_colnames=False, max_len=None):
+    if hasattr(df, "sparse"):
+        matrix = df.sparse.to_coo().tocsr()
+    else:
+        matrix = csr_matrix(df.to_numpy(dtype=bool))
+    n_invoices = matrix.shape[0]
+    bits = pack_columns(matrix)
+    supports = np.bitwise_count(bits).sum(axis=1) / n_invoices
+    frequent = np.flatnonzero(supports >= min_support)
+    labels = df.columns if use_colnames else np.arange(df.shape[1])
+    itemsets, itemset_supports = [], []
+
+    def extend(prefix, items, item_bits, item_supports):
+        for i, item in enumerate(items):
+            itemset = prefix + [item]
+            itemsets.append(itemset)
+            itemset_supports.append(item_supports[i])
+            if max_len is not None and len(itemset) >= max_len or i + 1 == len(items):
+                continue
+            candidate_bits = item_bits[i + 1:] & item_bits[i]
+            candidate_supports = np.bitwise_count(candidate_bits).sum(axis=1) / n_invoices
+            keep = candidate_supports >= min_support
+            if keep.any():
+                extend(itemset, items[i + 1:][keep], candidate_bits[keep], candidate_supports[keep])
+
+    extend([], frequent, bits[frequent], supports[frequent])
+    frequent_itemsets = pd.DataFrame({"support": itemset_supports,
+                                      "itemsets": [frozenset(labels[itemset]) for itemset in itemsets]})
+    # Shorter itemsets first, like apriori
+    order = np.argsort([len(itemset) for itemset in itemsets], kind="stable")
+    return frequent_itemsets.iloc[order].reset_index(drop=True)
+
+
+def rules_cache_path(cache_dir, country, id, min_support, min_count, max_len):
+    return os.path.join(cache_dir, f"rules_{country.replace(' ', '_')}_{'id' if id else 'desc'}_{min_support}_"
+                                   f"{min_count}_{max_len}.pkl")
+
+
+def country_min_support(n_invoices, min_support=0.01, min_count=5):
+    # A relative min_support alone makes a single basket frequent in a country with a few dozen invoices (2^basket
+    # size itemsets); an itemset also has to appear in at least min_count invoices.
+    return max(min_support, min_count / n_invoices)
+
+
+def mine_country_rules(country_df, path, id=True, min_support=0.01, max_len=4, miner=eclat):
+    inv_pro_df = create_invoice_product_df(country_df, id, sparse=True)
+    frequent_itemsets = miner(inv_pro_df, min_support=min_support, use_colnames=True, max_len=max_len)
+    rules = association_rules(frequent_itemsets, metric="support", min_threshold=min_support)
+    rules.to_pickle(path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return rules
+
+
+def create_rules_by_country(dataframe, id=True, countries=None, min_support=0.01, min_count=5, max_len=4,
+                            miner=eclat, cache_dir="outputs/arl_rules", n_jobs=4):
+    os.makedirs(cache_dir, exist_ok=True)
+    product_col = "StockCode" if id else "Description"
+    rules_by_country, todo, skipped = {}, {}, []
+    for country, country_df in dataframe.groupby("Country", sort=True):
+        if countries is not None and country not in countries:
+            continue
+        n_invoices = country_df["Invoice"].nunique()
+        # No itemset can reach min_count invoices
+        if n_invoices < min_count:
+            skipped.append(country)
+            continue
+        path = rules_cache_path(cache_dir, country, id, min_support, min_count, max_len)
+        if os.path.exists(path):
+            rules_by_country[country] = pd.read_pickle(path)
+        else:
+            # Workers only receive the columns the matrix is built from
+            todo[country] = (country_df[["Invoice", product_col, "Quantity"]], path,
+                             country_min_support(n_invoices, min_support, min_count))
+    print(f"{len(rules_by_country)} countries cached, {len(todo)} to mine, {len(skipped)} skipped "
+          f"(fewer than {min_count} invoices): {skipped}")
+
+    if n_jobs == 1:
+        for country, (country_df, path, country_support) in todo.items():
+            try:
+                rules_by_country[country] = mine_country_rules(country_df, path, id, country_support, max_len, miner)
+            except Exception as error:
+                print(f"{country} failed: {error!r}")
+    else:
+        with ProcessPoolExecutor(n_jobs) as executor:
+            futures = {executor.submit(mine_country_rules, country_df, path, id, country_support, max_len, miner):
+                       country for country, (country_df, path, country_support) in todo.items()}
+            for future in as_completed(futures):
+                try:
+                    rules_by_country[futures[future]] = future.result()
+                except Exception as error:
+                    print(f"{futures[future]} failed: {error!r}")
+    return dict(sorted(rules_by_country.items()))
+
+
+if __name__ == "__main__":
+    # pip install openpyxl
+    df = retail_data_prep(pd.read_excel("datasets/online_retail_II.xlsx", sheet_name="Year 2010-2011"))
+    create_rules_by_country(df, min_count=5, max_len=4, n_jobs=4)
@@ -0,0 +1,247 @@
+#############################
+# Collaborative Filtering Engines
+#############################
+
+# Shared by item_based_recommender.py, user_based_recommender.py and matrix_factorization_recommender.py.
+# The scripts run their whole walkthrough when imported, so the engines they build on live here:
+# - ItemCorrelationEngine: vectorized item-item Pearson correlations (item_based_recommender.py, Step 6)
+# - user_correlations / find_top_users: the target user's correlations with the candidate users
+#   (user_based_recommender.py, Step 8)
+# - UserBasedRecommender: user-based recommendations over resident rating data (user_based_recommender.py, Step 9)
+# - batch_user_based_recommender: the resumable batch job over a process pool (user_based_recommender.py, Step 10)
+# Nothing runs on import; the batch job over all users starts with: python collaborative_filtering.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, hstack
+from movie_lens import RatingStore, UserMovieMatrix, create_user_movie_matrix, load_movies, load_ratings
+
+
+class ItemCorrelationEngine:
+    def __init__(self, user_movie_matrix, min_support=0, shrinkage=0):
+        self.user_movie_matrix = user_movie_matrix
+        self.min_support = min_support
+        self.shrinkage = shrinkage
+        self.similarity = None
+
+    def correlation_block(self, codes):
+        # (n_movies, len(codes)) correlations of every movie with the given movies
+        users = self.user_movie_matrix.raters(codes)
+        ratings = self.user_movie_matrix.ratings[users].astype(np.float64)
+        rated = ratings.copy()
+        rated.data[:] = 1
+        target_ratings = ratings[:, codes]
+        target_rated = rated[:, codes]
+        n_codes = len(codes)
+        # B^T [b_x, r_x, r_x^2], R^T [b_x, r_x], (R^2)^T b_x: co-rated sums for every movie pair
+        rated_sums = (rated.T @ hstack([target_rated, target_ratings, target_ratings.power(2)])).toarray()
+        rating_sums = (ratings.T @ hstack([target_rated, target_ratings])).toarray()
+        squared_sums = (ratings.power(2).T @ target_rated).toarray()
+        n, sum_x, sum_xx = np.split(rated_sums, 3, axis=1)
+        sum_y, sum_xy = rating_sums[:, :n_codes], rating_sums[:, n_codes:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = (n * sum_xy - sum_x * sum_y) / np.sqrt((n * sum_xx - sum_x ** 2) * (n * squared_sums - sum_y ** 2))
+        # Pairs with few common raters can reach ~1.0 by chance: drop them and shrink the rest by n / (n + shrinkage)
+        corr[n < self.min_support] = np.nan
+        if self.shrinkage:
+            corr *= n / (n + self.shrinkage)
+        return corr
+
+    def precompute(self, block_size=256):
+        n_movies = self.user_movie_matrix.shape[1]
+        self.similarity = np.empty((n_movies, n_movies), dtype=np.float32)
+        for start in range(0, n_movies, block_size):
+            codes = np.arange(start, min(start + block_size, n_movies))
+            self.similarity[:, codes] = self.correlation_block(codes)
+        return self.similarity
+
+    def correlations(self, code):
+        if self.similarity is not None:
+            return self.similarity[:, code]
+        return self.correlation_block([code])[:, 0]
+
+    def neighbours(self, code, n=10):
+        corr = self.correlations(code)
+        # Filtered pairs are NaN, only the remaining candidates go through the top-n selection.
+        # The movie itself (corr 1.0) is not its own neighbour, as in ItemNeighbourTable
+        candidates = np.flatnonzero(~np.isnan(corr))
+        candidates = candidates[candidates != code]
+        n = min(n, len(candidates))
+        if n == 0:
+            return candidates, corr[candidates]
+        top = candidates[np.argpartition(-corr[candidates], n - 1)[:n]]
+        top = top[np.argsort(-corr[top], kind="stable")]
+        return top, corr[top]
+
+    def recommend(self, movie_name, n=10):
+        # Titles are only translated here, at the API boundary
+        codes, scores = self.neighbours(self.user_movie_matrix.movie_code(movie_name), n)
+        return pd.Series(scores, index=pd.Index(self.user_movie_matrix.titles[codes], name="title"),
+                         dtype=np.float64)
+
+
+def user_correlations(user_movie_matrix, user_code, candidates):
+    watched = user_movie_matrix.watched_codes(user_code)
+    target = user_movie_matrix.ratings[user_code, watched].toarray().ravel().astype(np.float64)
+    ratings = user_movie_matrix.ratings[candidates][:, watched].astype(np.float64)
+    rated = ratings.copy()
+    rated.data[:] = 1
+    ones = np.ones(len(watched))
+    n, sum_x, sum_xx = (rated @ np.column_stack([ones, target, target ** 2])).T
+    sum_y, sum_xy = (ratings @ np.column_stack([ones, target])).T
+    sum_yy = ratings.power(2) @ ones
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (n * sum_xy - sum_x * sum_y) / np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+
+
+def find_top_users(user_movie_matrix, random_user, ratio=60, cor_th=0.65):
+    user_code = user_movie_matrix.user_code(random_user)
+    movies_watched = user_movie_matrix.watched_codes(user_code)
+    user_movie_count = user_movie_matrix.watched_counts(movies_watched)
+    candidates = np.flatnonzero(user_movie_count > len(movies_watched) * ratio / 100)
+    candidates = candidates[candidates != user_code]
+    corr = user_correlations(user_movie_matrix, user_code, candidates)
+    similar = np.flatnonzero(corr >= cor_th)
+    similar = similar[np.argsort(-corr[similar], kind="stable")]
+    return pd.DataFrame({"userId": user_movie_matrix.user_ids[candidates[similar]], "corr": corr[similar]})
+
+
+class UserBasedRecommender:
+    def __init__(self, user_movie_matrix, rating_store=None, movie=None,
+                 rating_path='datasets/movie_lens_dataset/rating.csv',
+                 movie_path='datasets/movie_lens_dataset/movie.csv'):
+        self.user_movie_matrix = user_movie_matrix
+        if rating_store is None:
+            rating_store = RatingStore.from_ratings(load_ratings(rating_path, min_count=0))
+        self.rating_store = rating_store
+        self.movie = load_movies(movie_path) if movie is None else movie
+        # movieId -> movie code (position in movie.csv), -1 for movieIds missing from movie.csv
+        self.movie_ids = self.movie["movieId"].to_numpy()
+        self.titles = self.movie["title"].to_numpy(dtype=object)
+        self.movie_codes = np.full(max(self.movie_ids.max(), self.rating_store.movie_ids.max()) + 1, -1,
+                                   dtype=np.int64)
+        self.movie_codes[self.movie_ids] = np.arange(len(self.movie_ids))
+
+    def neighbour_ratings(self, top_users):
+        # (n_top_users, n_movies) sparse ratings of the top users, rows in top_users order
+        positions, movie_ids, ratings = self.rating_store.user_ratings(top_users["userId"].to_numpy())
+        codes = self.movie_codes[movie_ids]
+        known = codes >= 0
+        return csr_matrix((ratings[known], (positions[known], codes[known])),
+                          shape=(len(top_users), len(self.movie_ids)))
+
+    def score_codes(self, random_user, ratio=60, cor_th=0.65, score=3.5, n=None):
+        top_users = find_top_users(self.user_movie_matrix, random_user, ratio, cor_th)
+        neighbour_ratings = self.neighbour_ratings(top_users)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weighted_rating = (neighbour_ratings.T @ top_users["corr"].to_numpy()) / neighbour_ratings.getnnz(axis=0)
+        # Movies no top user rated are NaN and fail the comparison
+        codes = np.flatnonzero(weighted_rating > score)
+        if n is not None and n < len(codes):
+            codes = codes[np.argpartition(-weighted_rating[codes], n - 1)[:n]]
+        codes = codes[np.argsort(-weighted_rating[codes], kind="stable")]
+        return codes, weighted_rating[codes]
+
+    def scores(self, random_user, ratio=60, cor_th=0.65, score=3.5, n=None):
+        codes, weighted_rating = self.score_codes(random_user, ratio, cor_th, score, n)
+        return pd.DataFrame({"movieId": self.movie_ids[codes], "weighted_rating": weighted_rating})
+
+    def recommend(self, random_user, ratio=60, cor_th=0.65, score=3.5, n=None):
+        codes, weighted_rating = self.score_codes(random_user, ratio, cor_th, score, n)
+        return pd.DataFrame({"movieId": self.movie_ids[codes], "weighted_rating": weighted_rating,
+                             "title": self.titles[codes]})
+
+
+def share_arrays(arrays):
+    blocks, specs = [], {}
+    for name, array in arrays.items():
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+        blocks.append(block)
+        specs[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, specs
+
+
+batch_blocks = []
+batch_recommender = None
+
+
+def init_batch_worker(specs, titles, movie):
+    global batch_recommender
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        batch_blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+    ratings = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                         shape=(len(arrays["user_ids"]), len(arrays["movie_ids"])), copy=False)
+    user_movie_matrix = UserMovieMatrix(ratings, arrays["user_ids"], arrays["movie_ids"], titles)
+    rating_store = RatingStore(arrays["store_user_ids"], arrays["store_offsets"],
+                               arrays["store_movie_ids"], arrays["store_ratings"])
+    batch_recommender = UserBasedRecommender(user_movie_matrix, rating_store, movie)
+
+
+def part_path(output_dir, chunk_id):
+    return os.path.join(output_dir, f"part-{chunk_id:05d}.parquet")
+
+
+def recommend_chunk(chunk_id, user_ids, output_dir, ratio, cor_th, score):
+    results = []
+    for user_id in user_ids:
+        recommendations = batch_recommender.scores(user_id, ratio, cor_th, score)
+        recommendations.insert(0, "userId", user_id)
+        results.append(recommendations)
+    chunk_df = pd.concat(results, ignore_index=True)
+    path = part_path(output_dir, chunk_id)
+    # Hidden while it is written: pyarrow skips files starting with "." when reading output_dir, so a chunk
+    # interrupted mid-write does not break pd.read_parquet(output_dir)
+    tmp_path = os.path.join(output_dir, "." + os.path.basename(path) + ".tmp")
+    chunk_df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+    return len(user_ids)
+
+
+def batch_user_based_recommender(user_based, output_dir="outputs/user_based_recommendations", user_ids=None,
+                                 chunk_size=1000, n_jobs=4, ratio=60, cor_th=0.65, score=3.5):
+    os.makedirs(output_dir, exist_ok=True)
+    matrix, store = user_based.user_movie_matrix, user_based.rating_store
+    user_ids = matrix.user_ids if user_ids is None else np.asarray(user_ids)
+    chunks = [user_ids[start:start + chunk_size] for start in range(0, len(user_ids), chunk_size)]
+    todo = [chunk_id for chunk_id in range(len(chunks)) if not os.path.exists(part_path(output_dir, chunk_id))]
+    done = len(chunks) - len(todo)
+    print(f"{done}/{len(chunks)} chunks already done")
+
+    blocks, specs = share_arrays({"data": matrix.ratings.data, "indices": matrix.ratings.indices,
+                                  "indptr": matrix.ratings.indptr, "user_ids": matrix.user_ids,
+                                  "movie_ids": matrix.movie_ids, "store_user_ids": store.user_ids,
+                                  "store_offsets": store.offsets, "store_movie_ids": store.movie_ids,
+                                  "store_ratings": store.ratings})
+    failed = []
+    try:
+        with ProcessPoolExecutor(n_jobs, initializer=init_batch_worker,
+                                 initargs=(specs, matrix.titles, user_based.movie)) as executor:
+            futures = {executor.submit(recommend_chunk, chunk_id, chunks[chunk_id], output_dir,
+                                       ratio, cor_th, score): chunk_id for chunk_id in todo}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    done += 1
+                    print(f"{done}/{len(chunks)} chunks done")
+                except Exception as error:
+                    failed.append(futures[future])
+                    print(f"chunk {futures[future]} failed: {error!r}")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    if failed:
+        print(f"{len(failed)} chunks failed, run again to resume them")
+    return sorted(failed)
+
+
+if __name__ == "__main__":
+    user_based = UserBasedRecommender(create_user_movie_matrix())
+    batch_user_based_recommender(user_based, chunk_size=1000, n_jobs=4, cor_th=0.70, score=4)
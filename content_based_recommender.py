@@ -10,29 +10,46 @@
 # 2. Creating the Cosine Similarity Matrix
 # 3. Making Suggestions Based on Similarities
 # 4. Preparation of Working Script
+# 5. Sparse Top-k Similarity Index
+# 6. On-Demand Similarity Rows
+# 7. Saving and Loading the TF-IDF Model
+# 8. Prebuilt Title Index
+# 9. Batch Recommendations
+# 10. Approximate Nearest Neighbours (SVD + IVF)
+# 11. Incremental Catalogue Updates
+# 12. Title Search
 
 #################################
 # 1. Creating the TF-IDF Matrix
 #################################
 
+import os
+import time
+import numpy as np
 import pandas as pd
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 500)
 pd.set_option('display.expand_frame_repr', False)
 from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.decomposition import TruncatedSVD
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+from scipy.sparse import csr_matrix
+from movies_metadata import load_movies_metadata
+from title_search import TitleSearchIndex
 # https://www.kaggle.com/rounakbanik/the-movies-dataset
-df = pd.read_csv("datasets/the_movies_dataset/movies_metadata.csv", low_memory=False)  # for close DtypeWarning
+df = load_movies_metadata("datasets/the_movies_dataset/movies_metadata.csv",
+                          columns=["id", "title", "overview", "vote_average", "vote_count"])
 df.head()
-#    adult                              belongs_to_collection    budget                                             genres                              homepage     id    imdb_id original_language               original_title                                           overview popularity                       poster_path                               production_companies                               production_countries release_date      revenue  runtime                                   spoken_languages    status                                            tagline                        title  video  vote_average  vote_count
-# 0  False  {'id': 10194, 'name': 'Toy Story Collection', ...  30000000  [{'id': 16, 'name': 'Animation'}, {'id': 35, '...  http://toystory.disney.com/toy-story    862  tt0114709                en                    Toy Story  Led by Woody, Andy's toys live happily in his ...  21.946943  /rhIRbceoE9lR4veEXuwCC2wARtG.jpg     [{'name': 'Pixar Animation Studios', 'id': 3}]  [{'iso_3166_1': 'US', 'name': 'United States o...   1995-10-30  373554033.0     81.0           [{'iso_639_1': 'en', 'name': 'English'}]  Released                                                NaN                    Toy Story  False           7.7      5415.0
-# 1  False                                                NaN  65000000  [{'id': 12, 'name': 'Adventure'}, {'id': 14, '...                                   NaN   8844  tt0113497                en                      Jumanji  When siblings Judy and Peter discover an encha...  17.015539  /vzmL6fP7aPKNKPRTFnZmiUfciyV.jpg  [{'name': 'TriStar Pictures', 'id': 559}, {'na...  [{'iso_3166_1': 'US', 'name': 'United States o...   1995-12-15  262797249.0    104.0  [{'iso_639_1': 'en', 'name': 'English'}, {'iso...  Released          Roll the dice and unleash the excitement!                      Jumanji  False           6.9      2413.0
-# 2  False  {'id': 119050, 'name': 'Grumpy Old Men Collect...         0  [{'id': 10749, 'name': 'Romance'}, {'id': 35, ...                                   NaN  15602  tt0113228                en             Grumpier Old Men  A family wedding reignites the ancient feud be...    11.7129  /6ksm1sjKMFLbO7UY2i6G1ju9SML.jpg  [{'name': 'Warner Bros.', 'id': 6194}, {'name'...  [{'iso_3166_1': 'US', 'name': 'United States o...   1995-12-22          0.0    101.0           [{'iso_639_1': 'en', 'name': 'English'}]  Released  Still Yelling. Still Fighting. Still Ready for...             Grumpier Old Men  False           6.5        92.0
-# 3  False                                                NaN  16000000  [{'id': 35, 'name': 'Comedy'}, {'id': 18, 'nam...                                   NaN  31357  tt0114885                en            Waiting to Exhale  Cheated on, mistreated and stepped on, the wom...   3.859495  /16XOMpEaLWkrcPqSQqhTmeJuqQl.jpg  [{'name': 'Twentieth Century Fox Film Corporat...  [{'iso_3166_1': 'US', 'name': 'United States o...   1995-12-22   81452156.0    127.0           [{'iso_639_1': 'en', 'name': 'English'}]  Released  Friends are the people who let you be yourself...            Waiting to Exhale  False           6.1        34.0
-# 4  False  {'id': 96871, 'name': 'Father of the Bride Col...         0                     [{'id': 35, 'name': 'Comedy'}]                                   NaN  11862  tt0113041                en  Father of the Bride Part II  Just when George Banks has recovered from his ...   8.387519  /e64sOI48hQXyru7naBFyssKFxVd.jpg  [{'name': 'Sandollar Productions', 'id': 5842}...  [{'iso_3166_1': 'US', 'name': 'United States o...   1995-02-10   76578911.0    106.0           [{'iso_639_1': 'en', 'name': 'English'}]  Released  Just When His World Is Back To Normal... He's ...  Father of the Bride Part II  False           5.7       173.0
+#       id                        title                                           overview  vote_average  vote_count
+# 0    862                    Toy Story  Led by Woody, Andy's toys live happily in his ...           7.7      5415.0
+# 1   8844                      Jumanji  When siblings Judy and Peter discover an encha...           6.9      2413.0
+# 2  15602             Grumpier Old Men  A family wedding reignites the ancient feud be...           6.5        92.0
+# 3  31357            Waiting to Exhale  Cheated on, mistreated and stepped on, the wom...           6.1        34.0
+# 4  11862  Father of the Bride Part II  Just when George Banks has recovered from his ...           5.7       173.0
 
 df.shape
-# (45466, 24)
+# (45466, 5)
 
 df["overview"].head()
 # 0    Led by Woody, Andy's toys live happily in his ...
@@ -68,13 +85,14 @@ tfidf_matrix.toarray()
 # 2. Creating the Cosine Similarity Matrix
 #################################
 
-cosine_sim = cosine_similarity(tfidf_matrix,
-                               tfidf_matrix)
+# The full similarity matrix would be 45466 x 45466 float64 (~16 GB), more than a serving worker has, and every
+# query only reads one row of it. The similarities of one movie against all the others are that row: one sparse
+# row of tfidf_matrix times the transposed matrix.
 
-cosine_sim.shape
-# (45466, 45466)
+cosine_similarity(tfidf_matrix[1], tfidf_matrix).shape
+# (1, 45466)
 
-cosine_sim[1]
+cosine_similarity(tfidf_matrix[1], tfidf_matrix)[0]
 # array([0.01504121, 1.        , 0.04681953, ..., 0.        , 0.02198641,
 #        0.00929411])
 
@@ -107,11 +125,13 @@ indices["Sherlock Holmes"]
 # 35116
 movie_index = indices["Sherlock Holmes"]
 
-cosine_sim[movie_index]
+cosine_sim_row = cosine_similarity(tfidf_matrix[movie_index], tfidf_matrix)[0]
+
+cosine_sim_row
 # array([0.        , 0.00392837, 0.00476764, ..., 0.        , 0.0067919 ,
 #        0.        ])
 
-similarity_scores = pd.DataFrame(cosine_sim[movie_index],
+similarity_scores = pd.DataFrame(cosine_sim_row,
                                  columns=["score"])
 
 movie_indices = similarity_scores.sort_values("score", ascending=False)[1:11].index
@@ -133,19 +153,45 @@ df['title'].iloc[movie_indices]
 # 4. Preparation of Working Script
 #################################
 
-def content_based_recommender(title, cosine_sim, dataframe):
-    # Creating indexes
-    indices = pd.Series(dataframe.index, index=dataframe['title'])
-    indices = indices[~indices.index.duplicated(keep='last')]
+# cosine_sim is a dense similarity matrix (small catalogues only) or a neighbour index with most_similar;
+# the examples run against the top-k index of section 5.
+
+def content_based_recommender(title, cosine_sim, dataframe, title_index=None):
+    # Creating indexes (a prebuilt TitleIndex from section 8 skips this step on every call)
+    if title_index is None:
+        indices = pd.Series(dataframe.index, index=dataframe['title'])
+        indices = indices[~indices.index.duplicated(keep='last')]
+    else:
+        indices = title_index
     # capture title's index
     movie_index = indices[title]
+    # Precomputed neighbour index (see section 5): the neighbours are already sorted, no full row to scan
+    if hasattr(cosine_sim, "most_similar"):
+        movie_indices, _ = cosine_sim.most_similar(movie_index, 10)
+        return dataframe['title'].iloc[movie_indices]
     # Calculating similarity scores based on title
     similarity_scores = pd.DataFrame(cosine_sim[movie_index], columns=["score"])
     # Don't list the top 10 movies except it
     movie_indices = similarity_scores.sort_values("score", ascending=False)[1:11].index
     return dataframe['title'].iloc[movie_indices]
 
-content_based_recommender("Sherlock Holmes", cosine_sim, df)
+
+#################################
+# 5. Sparse Top-k Similarity Index
+#################################
+
+# A dense cosine_sim matrix is 45466 x 45466 float64 (~16 GB) and every query reads one full row of it.
+# Instead, we keep only the k nearest neighbours of every movie. The index is built block by block
+# from the sparse tfidf_matrix, so at most block_size rows of similarities sit in memory at once.
+
+from content_similarity import TopKSimilarityIndex, build_top_k_index, top_k_block, unit_rows
+
+top_k_index = build_top_k_index(tfidf_matrix, k=10)
+
+top_k_index.neighbours.shape
+# (45466, 10)
+
+content_based_recommender("Sherlock Holmes", top_k_index, df)
 # 34737    Приключения Шерлока Холмса и доктора Ватсона: ...
 # 14821                                    The Royal Scandal
 # 34750    The Adventures of Sherlock Holmes and Doctor W...
@@ -158,7 +204,7 @@ content_based_recommender("Sherlock Holmes", cosine_sim, df)
 # 29154                          Sherlock Holmes in New York
 # Name: title, dtype: object
 
-content_based_recommender("The Matrix", cosine_sim, df)
+content_based_recommender("The Matrix", top_k_index, df)
 # 44161                        A Detective Story
 # 44167                              Kid's Story
 # 44163                             World Record
@@ -171,7 +217,7 @@ content_based_recommender("The Matrix", cosine_sim, df)
 # 9159                                  Takedown
 # Name: title, dtype: object
 
-content_based_recommender("The Godfather", cosine_sim, df)
+content_based_recommender("The Godfather", top_k_index, df)
 # 1178               The Godfather: Part II
 # 44030    The Godfather Trilogy: 1972-1990
 # 1914              The Godfather: Part III
@@ -184,7 +230,7 @@ content_based_recommender("The Godfather", cosine_sim, df)
 # 26293                  Beck 28 - Familjen
 # Name: title, dtype: object
 
-content_based_recommender('The Dark Knight Rises', cosine_sim, df)
+content_based_recommender('The Dark Knight Rises', top_k_index, df)
 # 12481                                      The Dark Knight
 # 150                                         Batman Forever
 # 1328                                        Batman Returns
@@ -196,3 +242,381 @@ content_based_recommender('The Dark Knight Rises', cosine_sim, df)
 # 19792              Batman: The Dark Knight Returns, Part 1
 # 3095                          Batman: Mask of the Phantasm
 # Name: title, dtype: object
+
+
+#################################
+# 6. On-Demand Similarity Rows
+#################################
+
+# Building any similarity structure up front costs O(n^2). Right after the TF-IDF fit we can already serve any title:
+# one sparse mat-vec product gives the queried movie's similarities against the corpus and a partial selection
+# (argpartition) picks the top 10 without sorting all 45466 scores.
+
+class SparseRowSimilarity:
+    def __init__(self, tfidf_matrix):
+        self.tfidf_matrix = unit_rows(tfidf_matrix)
+
+    def most_similar(self, movie_index, n=10):
+        scores = (self.tfidf_matrix @ self.tfidf_matrix[movie_index].T).toarray().ravel()
+        scores[movie_index] = -np.inf
+        n = min(n, len(scores) - 1)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+
+row_similarity = SparseRowSimilarity(tfidf_matrix)
+
+content_based_recommender("Sherlock Holmes", row_similarity, df)
+
+content_based_recommender("The Godfather", row_similarity, df)
+
+
+#################################
+# 7. Saving and Loading the TF-IDF Model
+#################################
+
+# Every run re-reads movies_metadata.csv and re-fits the TfidfVectorizer before answering anything.
+# The fitted vocabulary, idf weights, CSR arrays, titles and ids (row number = movie index) are written as .npy files.
+# Workers open them with np.load(mmap_mode="r"): the pages are shared between processes and loading is instant.
+
+def save_tfidf_model(tfidf, tfidf_matrix, dataframe, path="models/overview_tfidf"):
+    os.makedirs(path, exist_ok=True)
+    tfidf_matrix = unit_rows(tfidf_matrix)
+    arrays = {"terms": tfidf.get_feature_names_out().astype(str),
+              "idf": tfidf.idf_.astype(np.float32),
+              "data": tfidf_matrix.data,
+              "indices": tfidf_matrix.indices,
+              "indptr": tfidf_matrix.indptr,
+              "titles": dataframe["title"].fillna("").to_numpy(dtype=str),
+              "ids": pd.to_numeric(dataframe["id"], errors="coerce").fillna(-1).to_numpy(dtype=np.int64)}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), array)
+
+
+def load_tfidf_model(path="models/overview_tfidf"):
+    arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+              for name in ["terms", "idf", "data", "indices", "indptr", "titles", "ids"]}
+    tfidf_matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                              shape=(len(arrays["indptr"]) - 1, len(arrays["terms"])), copy=False)
+    # The vectorizer is only needed to transform new overviews
+    tfidf = TfidfVectorizer(stop_words="english",
+                            vocabulary={term: i for i, term in enumerate(arrays["terms"])})
+    tfidf.idf_ = np.asarray(arrays["idf"], dtype=np.float64)
+    titles = pd.DataFrame({"title": arrays["titles"], "id": arrays["ids"]})
+    return tfidf, tfidf_matrix, titles
+
+
+save_tfidf_model(tfidf, tfidf_matrix, df)
+
+tfidf, tfidf_matrix, titles = load_tfidf_model()
+
+content_based_recommender("Sherlock Holmes", SparseRowSimilarity(tfidf_matrix), titles)
+
+
+#################################
+# 8. Prebuilt Title Index
+#################################
+
+# content_based_recommender rebuilds the title -> index Series on every call (an O(n) hash build over 45466 titles)
+# and duplicated(keep='last') silently hides 10 of the 11 "Cinderella" movies.
+# TitleIndex is built once: exact title lookup, lookup by movie id and all candidates of an ambiguous title.
+# Duplicate titles resolve deterministically: the row with the highest `prefer` column value, else the last row.
+
+class TitleIndex:
+    def __init__(self, dataframe, prefer=None):
+        positions = pd.Series(np.arange(len(dataframe)))
+        self.candidates_by_title = positions.groupby(dataframe["title"].to_numpy()).indices
+        if prefer is None:
+            self.best = {title: rows[-1] for title, rows in self.candidates_by_title.items()}
+        else:
+            preference = pd.to_numeric(dataframe[prefer], errors="coerce").fillna(-np.inf).to_numpy()
+            self.best = {title: rows[len(rows) - 1 - np.argmax(preference[rows][::-1])]
+                         for title, rows in self.candidates_by_title.items()}
+        self.by_movie_id = {}
+        if "id" in dataframe:
+            movie_ids = pd.to_numeric(dataframe["id"], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            self.by_movie_id = {int(movie_id): row for row, movie_id in enumerate(movie_ids)
+                                if not np.isnan(movie_id) and movie_id >= 0}
+
+    def __getitem__(self, title):
+        return self.best[title]
+
+    def __contains__(self, title):
+        return title in self.best
+
+    def by_id(self, movie_id):
+        return self.by_movie_id[int(movie_id)]
+
+    def candidates(self, title):
+        return self.candidates_by_title.get(title, np.array([], dtype=np.int64))
+
+
+title_index = TitleIndex(df)
+
+title_index["Cinderella"]
+# 45406
+
+len(title_index.candidates("Cinderella"))
+# 11
+
+title_index.by_id(862)
+# 0
+
+title_index = TitleIndex(df, prefer="vote_count")
+
+content_based_recommender("Sherlock Holmes", top_k_index, df, title_index)
+
+df['title'].iloc[title_index.candidates("Cinderella")]
+
+
+#################################
+# 9. Batch Recommendations
+#################################
+
+# The nightly "similar movies" cache called content_based_recommender once per title (45466 row extractions + sorts).
+# Here a block of queries is scored with one sparse matrix-matrix product, block_size bounds the memory
+# (block_size x n_movies float32 scores per block) and the blocks can be spread over a process pool.
+# The result is a compact (n_queries x n) array of neighbour indices and one of scores.
+
+from content_similarity import batch_content_based_recommender
+
+# The job over the whole catalogue with a process pool runs from content_similarity.py, not from this script:
+#   python content_similarity.py
+# With spawn / forkserver (macOS, Windows, Python 3.14 on Linux) each worker imports the main module, and started
+# from here every worker would re-read the CSV, re-fit TF-IDF and rebuild the indexes before its first block.
+# It writes the (45466, 10) neighbours and scores to outputs/content_based_recommendations/*.npy.
+# A few titles are scored in this process (n_jobs=1):
+
+neighbours, scores = batch_content_based_recommender(["Sherlock Holmes", "The Matrix", "The Godfather"],
+                                                     tfidf_matrix, title_index)
+df['title'].to_numpy()[neighbours]
+
+
+#################################
+# 10. Approximate Nearest Neighbours (SVD + IVF)
+#################################
+
+# Exact cosine over 75827 TF-IDF features grows linearly with the catalogue for every query.
+# IVFIndex reduces the overviews to a dense TruncatedSVD embedding and splits the catalogue into n_lists clusters
+# (spherical k-means, numpy only). A query only scans the movies of the n_probe closest clusters:
+# n_probe is the recall vs latency knob. With rerank=True the candidates are scored with the exact TF-IDF cosine.
+# IVFIndex has most_similar, so it plugs into content_based_recommender like the other indexes.
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, random_state=42):
+    rng = np.random.default_rng(random_state)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)]
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        members = csr_matrix((np.ones(len(vectors), dtype=np.float32), (assignment, np.arange(len(vectors)))),
+                             shape=(n_clusters, len(vectors)))
+        sums = members @ vectors
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        centroids = np.where(norms > 0, sums / np.maximum(norms, 1e-12), centroids).astype(np.float32)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class IVFIndex:
+    def __init__(self, tfidf_matrix, n_components=128, n_lists=None, n_probe=8, rerank=True, random_state=42):
+        self.tfidf_matrix = unit_rows(tfidf_matrix)
+        svd = TruncatedSVD(n_components=n_components, random_state=random_state)
+        self.embeddings = normalize(svd.fit_transform(self.tfidf_matrix)).astype(np.float32)
+        n_lists = n_lists or int(np.sqrt(self.tfidf_matrix.shape[0]))
+        self.centroids, assignment = spherical_kmeans(self.embeddings, n_lists, random_state=random_state)
+        # Inverted lists: the movies of list l are list_members[list_offsets[l]:list_offsets[l + 1]]
+        self.list_members = np.argsort(assignment, kind="stable").astype(np.int32)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))])
+        self.n_probe = n_probe
+        self.rerank = rerank
+
+    def most_similar(self, movie_index, n=10, n_probe=None):
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        query = self.embeddings[movie_index]
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        candidates = np.concatenate([self.list_members[self.list_offsets[l]:self.list_offsets[l + 1]]
+                                     for l in lists])
+        candidates = candidates[candidates != movie_index]
+        if self.rerank:
+            scores = (self.tfidf_matrix[candidates] @ self.tfidf_matrix[movie_index].T).toarray().ravel()
+        else:
+            scores = self.embeddings[candidates] @ query
+        n = min(n, len(candidates))
+        if n == 0:
+            return candidates, scores
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return candidates[top], scores[top]
+
+
+def benchmark_ann(tfidf_matrix, ann_index, n_probes=(1, 2, 4, 8, 16, 32), n_queries=200, n=10, random_state=42):
+    tfidf_matrix = unit_rows(tfidf_matrix)
+    queries = np.random.default_rng(random_state).choice(tfidf_matrix.shape[0], n_queries, replace=False)
+    # Exact reference: cosine_similarity against the whole corpus. Ties are common (e.g. many 0 scores), so a found
+    # neighbour counts as a hit if its exact score reaches the exact n-th best score.
+    start = time.perf_counter()
+    thresholds = []
+    for query in queries:
+        exact_scores = cosine_similarity(tfidf_matrix[query], tfidf_matrix).ravel()
+        exact_scores[query] = -np.inf
+        thresholds.append(np.partition(exact_scores, len(exact_scores) - n)[len(exact_scores) - n])
+    results = [{"n_probe": "exact", f"recall@{n}": 1.0,
+                "ms_per_query": (time.perf_counter() - start) * 1000 / n_queries}]
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found = [ann_index.most_similar(query, n, n_probe)[0] for query in queries]
+        elapsed = time.perf_counter() - start
+        hits = [np.sum((tfidf_matrix[neighbours] @ tfidf_matrix[query].T).toarray().ravel() >= threshold - 1e-6)
+                for query, neighbours, threshold in zip(queries, found, thresholds)]
+        results.append({"n_probe": n_probe, f"recall@{n}": np.sum(hits) / (n * n_queries),
+                        "ms_per_query": elapsed * 1000 / n_queries})
+    return pd.DataFrame(results)
+
+
+ivf_index = IVFIndex(tfidf_matrix, n_components=128, n_probe=8)
+
+content_based_recommender("Sherlock Holmes", ivf_index, df, title_index)
+
+benchmark_ann(tfidf_matrix, ivf_index)
+
+
+#################################
+# 11. Incremental Catalogue Updates
+#################################
+
+# Adding one movie meant re-fitting the TfidfVectorizer and rebuilding the whole similarity structure.
+# IncrementalTfidf starts from the fitted tfidf_matrix and its idf, keeps the document frequencies, tokenizes only
+# the new overviews and updates the idf in place (smooth idf, as in TfidfVectorizer: ln((1 + n) / (1 + df)) + 1).
+# Every new movie shifts all idf values slightly through n; an idf is only refreshed once it has drifted more than
+# idf_tol (relative), so only the movies containing those terms get new weights: their entries are scaled by
+# new idf / old idf and the rows renormalized, in place. All other rows are left untouched.
+# update_top_k_index then patches the neighbour lists: changed movies and lists that contain a changed movie are
+# recomputed, lists that a changed movie now enters are merged, all other lists are kept.
+
+class IncrementalTfidf:
+    def __init__(self, tfidf, tfidf_matrix, idf_tol=0.01):
+        self.analyzer = tfidf.build_analyzer()
+        self.vocabulary = {term: i for i, term in enumerate(tfidf.get_feature_names_out())}
+        self.idf_tol = idf_tol
+        # One copy, later updated in place
+        self.tfidf_matrix = tfidf_matrix.tocsr().astype(np.float32)
+        self.n_documents = self.tfidf_matrix.shape[0]
+        self.doc_freq = np.bincount(self.tfidf_matrix.indices, minlength=len(self.vocabulary))
+        self.idf = tfidf.idf_.copy()
+
+    def count(self, overviews):
+        # New terms get new columns at the end of the vocabulary
+        overviews = list(overviews)
+        rows, cols = [], []
+        for row, overview in enumerate(overviews):
+            for term in self.analyzer(overview):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+        return csr_matrix((np.ones(len(cols)), (rows, cols)), shape=(len(overviews), len(self.vocabulary)))
+
+    def current_idf(self):
+        return np.log((1 + self.n_documents) / (1 + self.doc_freq)) + 1
+
+    def reweight_rows(self, rows, ratio):
+        # Scale the entries of the given rows by ratio[term] and renormalize them, in place
+        matrix = self.tfidf_matrix
+        starts, ends = matrix.indptr[rows], matrix.indptr[rows + 1]
+        lengths = ends - starts
+        entries = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        data = matrix.data[entries] * ratio[matrix.indices[entries]]
+        norms = np.sqrt(np.add.reduceat(data.astype(np.float64) ** 2, np.cumsum(lengths) - lengths))
+        matrix.data[entries] = data / np.repeat(norms, lengths)
+
+    def add_documents(self, overviews):
+        n_old = self.tfidf_matrix.shape[0]
+        new_counts = self.count(overviews)
+        n_terms = len(self.vocabulary)
+        self.n_documents += new_counts.shape[0]
+        self.doc_freq = np.concatenate([self.doc_freq, np.zeros(n_terms - len(self.doc_freq), dtype=np.int64)])
+        self.doc_freq += np.bincount(new_counts.indices, minlength=n_terms)
+        old_idf = np.concatenate([self.idf, np.zeros(n_terms - len(self.idf))])
+        fresh_idf = self.current_idf()
+        refreshed = np.abs(fresh_idf - old_idf) > self.idf_tol * fresh_idf
+        self.idf = np.where(refreshed, fresh_idf, old_idf)
+
+        # Old movies holding a refreshed term (new terms only occur in the new movies)
+        reweighted_rows = np.unique(np.repeat(np.arange(n_old), np.diff(self.tfidf_matrix.indptr))[
+            refreshed[self.tfidf_matrix.indices]])
+        if len(reweighted_rows):
+            ratio = np.ones(n_terms)
+            ratio[refreshed] = fresh_idf[refreshed] / np.where(old_idf[refreshed] > 0, old_idf[refreshed], 1)
+            self.reweight_rows(reweighted_rows, ratio)
+
+        # The new movies are weighted on their own and appended to the CSR arrays
+        new_matrix = normalize(new_counts.multiply(self.idf).tocsr().astype(np.float32))
+        matrix = self.tfidf_matrix
+        self.tfidf_matrix = csr_matrix((np.concatenate([matrix.data, new_matrix.data]),
+                                        np.concatenate([matrix.indices, new_matrix.indices]),
+                                        np.concatenate([matrix.indptr, new_matrix.indptr[1:] + matrix.indptr[-1]])),
+                                       shape=(n_old + new_matrix.shape[0], n_terms))
+        new_rows = np.arange(n_old, self.tfidf_matrix.shape[0])
+        return new_rows, np.concatenate([reweighted_rows, new_rows])
+
+
+def update_top_k_index(top_k_index, tfidf_matrix, changed_rows, block_size=500):
+    tfidf_matrix = unit_rows(tfidf_matrix)
+    n_movies, k = tfidf_matrix.shape[0], top_k_index.neighbours.shape[1]
+    n_old = len(top_k_index.neighbours)
+    neighbours = np.vstack([top_k_index.neighbours, np.zeros((n_movies - n_old, k), dtype=np.int32)])
+    scores = np.vstack([top_k_index.scores, np.full((n_movies - n_old, k), -np.inf, dtype=np.float32)])
+    changed = np.zeros(n_movies, dtype=bool)
+    changed[changed_rows] = True
+
+    # Similarities of every movie to the changed movies, without the movies themselves
+    cross = (tfidf_matrix @ tfidf_matrix[changed_rows].T).tocoo()
+    keep = cross.row != changed_rows[cross.col]
+    cross = csr_matrix((cross.data[keep], (cross.row[keep], cross.col[keep])), shape=cross.shape)
+
+    # Changed movies and lists holding a changed movie (its score is stale) are recomputed from scratch
+    recompute = np.flatnonzero(changed | changed[neighbours].any(axis=1))
+    for start in range(0, len(recompute), block_size):
+        rows = recompute[start:start + block_size]
+        neighbours[rows], scores[rows] = top_k_block(tfidf_matrix, rows, k)
+
+    # Lists that a changed movie now enters: merge the old list with the changed movies' scores
+    best_cross = cross.max(axis=1).toarray().ravel()
+    merge = np.flatnonzero((best_cross > scores[:, -1]) & ~np.isin(np.arange(n_movies), recompute))
+    for start in range(0, len(merge), block_size):
+        rows = merge[start:start + block_size]
+        candidates = np.hstack([neighbours[rows], np.broadcast_to(changed_rows, (len(rows), len(changed_rows)))])
+        candidate_scores = np.hstack([scores[rows], cross[rows].toarray()])
+        top = np.argsort(-candidate_scores, axis=1, kind="stable")[:, :k]
+        neighbours[rows] = np.take_along_axis(candidates, top, axis=1)
+        scores[rows] = np.take_along_axis(candidate_scores, top, axis=1)
+    return TopKSimilarityIndex(neighbours, scores), np.union1d(recompute, merge)
+
+
+incremental_tfidf = IncrementalTfidf(tfidf, tfidf_matrix)
+
+new_movies = pd.DataFrame({"title": ["Sherlock Holmes: The Lost Case"],
+                           "id": [-1],
+                           "overview": ["Sherlock Holmes and Doctor Watson investigate a murder in Victorian London."]})
+
+new_rows, changed_rows = incremental_tfidf.add_documents(new_movies['overview'])
+
+df = pd.concat([df, new_movies], ignore_index=True)
+title_index = TitleIndex(df)
+top_k_index, patched_rows = update_top_k_index(top_k_index, incremental_tfidf.tfidf_matrix, changed_rows)
+
+content_based_recommender("Sherlock Holmes: The Lost Case", top_k_index, df, title_index)
+
+
+#################################
+# 12. Title Search
+#################################
+
+# Title autocomplete over the catalogue: prefix and trigram substring search built once (title_search.py,
+# shared with item_based_recommender.py). Search results are row numbers, so they index df and the similarity indexes.
+
+title_search = TitleSearchIndex(df['title'])
+
+df['title'].iloc[title_search.search("sherlock", limit=10)]
+
+title_search.search_titles("godf", limit=5)
+
+content_based_recommender(title_search.search_titles("dark knight rises", limit=1)[0], top_k_index, df, title_index)
@@ -0,0 +1,105 @@
+#############################
+# Content-Based Similarity Index
+#############################
+
+# Shared by content_based_recommender.py (sections 5, 9, 10 and 11).
+# Top-k cosine neighbours computed block by block from the sparse TF-IDF matrix, and the batch recommender that
+# spreads the blocks over a process pool.
+# Importing it only defines functions, so it is also the entry point of the batch job over the whole catalogue:
+#   python content_similarity.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from sklearn.preprocessing import normalize
+from sklearn.utils.extmath import row_norms
+
+
+def unit_rows(tfidf_matrix):
+    # TfidfVectorizer rows are already l2 normalized; don't copy the matrix (it may be memory-mapped) if so
+    tfidf_matrix = tfidf_matrix.tocsr().astype(np.float32, copy=False)
+    norms = row_norms(tfidf_matrix)
+    if np.allclose(norms[norms > 0], 1, atol=1e-4):
+        return tfidf_matrix
+    return normalize(tfidf_matrix)
+
+
+def top_k_block(tfidf_matrix, rows, k=10):
+    # Similarities of a block of movies against the whole corpus (rows are l2 normalized, dot product = cosine)
+    block_scores = (tfidf_matrix[rows] @ tfidf_matrix.T).toarray()
+    # The movie itself is not a recommendation
+    block_scores[np.arange(len(rows)), rows] = -np.inf
+    k = min(k, tfidf_matrix.shape[0] - 1)
+    top = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(block_scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1).astype(np.int32), \
+        np.take_along_axis(top_scores, order, axis=1).astype(np.float32)
+
+
+class TopKSimilarityIndex:
+    def __init__(self, neighbours, scores):
+        # neighbours: (n_movies, k) int32 movie indices, scores: (n_movies, k) float32, both sorted by score
+        self.neighbours = neighbours
+        self.scores = scores
+
+    def most_similar(self, movie_index, n=10):
+        return self.neighbours[movie_index, :n], self.scores[movie_index, :n]
+
+
+def build_top_k_index(tfidf_matrix, k=10, block_size=500):
+    tfidf_matrix = unit_rows(tfidf_matrix)
+    n_movies = tfidf_matrix.shape[0]
+    k = min(k, n_movies - 1)
+    neighbours = np.empty((n_movies, k), dtype=np.int32)
+    scores = np.empty((n_movies, k), dtype=np.float32)
+    for start in range(0, n_movies, block_size):
+        rows = np.arange(start, min(start + block_size, n_movies))
+        neighbours[rows], scores[rows] = top_k_block(tfidf_matrix, rows, k)
+    return TopKSimilarityIndex(neighbours, scores)
+
+
+batch_matrix = None
+
+
+def init_batch_worker(tfidf_matrix):
+    # Each worker receives the matrix once instead of once per block
+    global batch_matrix
+    batch_matrix = tfidf_matrix
+
+
+def batch_worker(rows, n):
+    return top_k_block(batch_matrix, rows, n)
+
+
+def batch_content_based_recommender(queries, tfidf_matrix, title_index=None, n=10, block_size=500, n_jobs=1):
+    # Titles are resolved through the title index, integers are taken as movie indices
+    rows = np.array([query if isinstance(query, (int, np.integer)) else title_index[query] for query in queries],
+                    dtype=np.int64)
+    tfidf_matrix = unit_rows(tfidf_matrix)
+    n = min(n, tfidf_matrix.shape[0] - 1)
+    if len(rows) == 0:
+        return np.empty((0, n), dtype=np.int32), np.empty((0, n), dtype=np.float32)
+    blocks = [rows[start:start + block_size] for start in range(0, len(rows), block_size)]
+    if n_jobs == 1:
+        results = [top_k_block(tfidf_matrix, block, n) for block in blocks]
+    else:
+        with ProcessPoolExecutor(n_jobs, initializer=init_batch_worker, initargs=(tfidf_matrix,)) as executor:
+            results = list(executor.map(batch_worker, blocks, [n] * len(blocks)))
+    neighbours = np.vstack([block_neighbours for block_neighbours, _ in results])
+    scores = np.vstack([block_scores for _, block_scores in results])
+    return neighbours, scores
+
+
+if __name__ == "__main__":
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from movies_metadata import load_movies_metadata
+
+    df = load_movies_metadata("datasets/the_movies_dataset/movies_metadata.csv",
+                              columns=["id", "title", "overview", "vote_average", "vote_count"])
+    tfidf_matrix = TfidfVectorizer(stop_words="english").fit_transform(df["overview"].fillna(""))
+    neighbours, scores = batch_content_based_recommender(df.index, tfidf_matrix, n=10, block_size=500, n_jobs=4)
+    # Row i holds the neighbours (movie indices) of movie i and their scores
+    os.makedirs("outputs/content_based_recommendations", exist_ok=True)
+    np.save("outputs/content_based_recommendations/neighbours.npy", neighbours)
+    np.save("outputs/content_based_recommendations/scores.npy", scores)
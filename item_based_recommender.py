@@ -7,6 +7,8 @@
 ######################################
 # Step 1: Preparation of the Data Set
 ######################################
+import os
+import numpy as np
 import pandas as pd
 pd.set_option('display.max_columns', 500)
 pd.set_option('display.width', 500)
@@ -97,6 +99,9 @@ user_movie_df.corrwith(movie_name).sort_values(ascending=False).head(10)
 
 
 def check_film(keyword, user_movie_df):
+    # UserMovieMatrix (Step 5) has a prebuilt title search index (title_search.py)
+    if hasattr(user_movie_df, "search"):
+        return user_movie_df.titles[user_movie_df.search(keyword)].tolist()
     return [col for col in user_movie_df.columns if keyword in col]
 
 check_film("Lord", user_movie_df)
@@ -129,6 +134,9 @@ user_movie_df = create_user_movie_df()
 
 
 def item_based_recommender(movie_name, user_movie_df):
+    # Vectorized engine (Step 6)
+    if hasattr(user_movie_df, "recommend"):
+        return user_movie_df.recommend(movie_name)
     movie_name = user_movie_df[movie_name]
     return user_movie_df.corrwith(movie_name).sort_values(ascending=False).head(10)
 
@@ -163,5 +171,118 @@ item_based_recommender(movie_name, user_movie_df)
 # dtype: float64
 
 
+######################################
+# Step 5: Sparse User Movie Matrix
+######################################
+
+# user_movie_df is a dense 138493 x 3159 float64 frame (~3.5 GB, mostly NaN).
+# create_user_movie_matrix builds the same ratings as a sparse CSR matrix from the integer userId / movieId columns.
+from movie_lens import create_user_movie_matrix
+
+user_movie_matrix = create_user_movie_matrix()
+
+user_movie_matrix.shape
+
+user_movie_matrix["Matrix, The (1999)"]
+
+user_movie_matrix.row(41531)
+
+check_film("Lord", user_movie_matrix)
+
+
+######################################
+# Step 6: Vectorized Item-Item Correlations
+######################################
+
+# corrwith runs 3159 separate Series correlations, each with its own NaN alignment, on every request.
+# The same pairwise-complete Pearson correlation comes from a few sparse products over the users who rated the movie(s):
+# co-rated counts n, sums Sx, Sy, sums of squares Sxx, Syy and the cross sum Sxy, then
+# corr = (n * Sxy - Sx * Sy) / sqrt((n * Sxx - Sx^2) * (n * Syy - Sy^2))
+# precompute() builds the full n_movies x n_movies item similarity matrix offline, block by block.
+# n comes out of the same pass, so min_support (minimum co-rating count) and the significance weight
+# n / (n + shrinkage) cost no extra pass; the defaults (0, 0) give the plain corrwith result.
+# Unlike the corrwith list, recommendations leave out the movie itself (its correlation with itself is 1.0).
+# ItemCorrelationEngine lives in collaborative_filtering.py, so the other scripts can import it.
+from collaborative_filtering import ItemCorrelationEngine
+
+item_engine = ItemCorrelationEngine(user_movie_matrix)
+
+item_based_recommender("Matrix, The (1999)", item_engine)
+
+item_engine.precompute()
+
+item_engine.similarity.shape
+
+item_based_recommender("Mask, The (1994)", item_engine)
+
+item_engine = ItemCorrelationEngine(user_movie_matrix, min_support=50, shrinkage=100)
+
+item_based_recommender("Matrix, The (1999)", item_engine)
+
+
+######################################
+# Step 7: Precomputed Item Neighbour Table
+######################################
+
+# Item pages need "people who liked X also liked" for every one of the common movies.
+# build() runs the engine offline over blocks of movies and keeps each movie's top-n correlated movies in
+# (n_movies, n) int32 movie codes and float32 scores (-1 / NaN pad short lists), ~250 KB for ~3000 x 10.
+# recommend() answers from the table in constant time and falls back to the live engine for missing movies.
+
+class ItemNeighbourTable:
+    def __init__(self, engine, neighbours, scores):
+        self.engine = engine
+        self.neighbours = neighbours
+        self.scores = scores
+
+    @classmethod
+    def build(cls, engine, n=10, codes=None, block_size=256):
+        n_movies = engine.user_movie_matrix.shape[1]
+        codes = np.arange(n_movies) if codes is None else np.asarray(codes)
+        n = min(n, n_movies - 1)
+        neighbours = np.full((n_movies, n), -1, dtype=np.int32)
+        scores = np.full((n_movies, n), np.nan, dtype=np.float32)
+        for start in range(0, len(codes), block_size):
+            block = codes[start:start + block_size]
+            corr = engine.correlation_block(block).T
+            corr = np.where(np.isnan(corr), -np.inf, corr)
+            # The movie itself is not its own neighbour
+            corr[np.arange(len(block)), block] = -np.inf
+            top = np.argpartition(-corr, n - 1, axis=1)[:, :n]
+            top_scores = np.take_along_axis(corr, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_scores = np.take_along_axis(top_scores, order, axis=1)
+            found = np.isfinite(top_scores)
+            neighbours[block] = np.where(found, top, -1)
+            scores[block] = np.where(found, top_scores, np.nan)
+        return cls(engine, neighbours, scores)
+
+    def save(self, path="models/item_neighbours.npz"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, neighbours=self.neighbours, scores=self.scores)
+
+    @classmethod
+    def load(cls, engine, path="models/item_neighbours.npz"):
+        arrays = np.load(path)
+        return cls(engine, arrays["neighbours"], arrays["scores"])
+
+    def neighbour_codes(self, code, n=10):
+        # Rows that were not built (or hold no neighbour at all) go to the live engine
+        if self.neighbours[code, 0] < 0 or n > self.neighbours.shape[1]:
+            return self.engine.neighbours(code, n)
+        found = self.neighbours[code, :n] >= 0
+        return self.neighbours[code, :n][found], self.scores[code, :n][found]
+
+    def recommend(self, movie_name, n=10):
+        codes, scores = self.neighbour_codes(self.engine.user_movie_matrix.movie_code(movie_name), n)
+        return pd.Series(scores, index=pd.Index(self.engine.user_movie_matrix.titles[codes], name="title"),
+                         dtype=np.float64)
+
+
+item_table = ItemNeighbourTable.build(item_engine, n=10)
+item_table.save()
 
+item_table = ItemNeighbourTable.load(item_engine)
 
+item_based_recommender("Matrix, The (1999)", item_table)
@@ -0,0 +1,255 @@
+###########################################
+# Matrix Factorization Recommender (ALS)
+###########################################
+
+# Data set: https://grouplens.org/datasets/movielens/
+
+# item_based_recommender.py (corrwith) and user_based_recommender.py (user-user correlation) are memory-based:
+# every request goes back to the raw ratings, and the cost grows with the number of users who rated something.
+# A latent factor model learns, offline, a k-dimensional vector for every user and every movie such that
+# rating ~ global mean + user_factors[u] @ item_factors[i].
+# Scoring a user against all common movies is then one (n_movies, k) x (k,) product and a top-n selection.
+
+# 1. Preparation of the Data Set
+# 2. Training / Test Split
+# 3. Alternating Least Squares
+# 4. Making Recommendations
+# 5. Benchmark Against the Memory-Based Recommenders
+
+######################################
+# 1. Preparation of the Data Set
+######################################
+import time
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from movie_lens import RatingStore, UserMovieMatrix, create_user_movie_matrix, load_movies
+from collaborative_filtering import ItemCorrelationEngine, UserBasedRecommender
+pd.set_option('display.max_columns', None)
+pd.set_option('display.width', 500)
+
+# Same input as the memory-based recommenders: the sparse user x movie ratings of the common movies
+user_movie_matrix = create_user_movie_matrix()
+
+user_movie_matrix.shape
+
+
+######################################
+# 2. Training / Test Split
+######################################
+
+# A random share of every user's ratings is held out; the model and the memory-based recommenders are
+# trained on the rest and evaluated on the held-out ratings.
+
+def train_test_split(user_movie_matrix, test_size=0.1, random_state=42):
+    ratings = user_movie_matrix.ratings.tocoo()
+    rng = np.random.default_rng(random_state)
+    test = rng.random(ratings.nnz) < test_size
+    train_ratings = csr_matrix((ratings.data[~test], (ratings.row[~test], ratings.col[~test])),
+                               shape=ratings.shape)
+    train_matrix = UserMovieMatrix(train_ratings, user_movie_matrix.user_ids, user_movie_matrix.movie_ids,
+                                   user_movie_matrix.titles)
+    # Held-out ratings as (user code, movie code, rating) arrays
+    return train_matrix, (ratings.row[test], ratings.col[test], ratings.data[test])
+
+
+train_matrix, test_ratings = train_test_split(user_movie_matrix)
+
+
+######################################
+# 3. Alternating Least Squares
+######################################
+
+# With the item factors fixed, every user's factors are a small (k x k) regularized least squares problem, and
+# vice versa, so training alternates between the two sides:
+# user_factors[u] = (Q_u^T Q_u + reg * n_u * I)^-1 Q_u^T (r_u - mean)
+# where Q_u are the factors of the n_u movies user u rated (weighted-lambda regularization).
+# Only numpy: the right-hand sides are one sparse x dense product, the Q_u^T Q_u grams of a block of rows come
+# from one product of the 0/1 rated matrix with the flattened outer products q q^T (or one BLAS gram per row
+# when that table gets too large, i.e. for the movie side with 138k users), and each block is one batched solve.
+
+class ALSRecommender:
+    def __init__(self, n_factors=32, regularization=0.05, n_iter=10, random_state=42):
+        self.n_factors = n_factors
+        self.regularization = regularization
+        self.n_iter = n_iter
+        self.random_state = random_state
+        self.global_mean = 0.0
+        self.user_factors = None
+        self.item_factors = None
+
+    def fit(self, user_movie_matrix, verbose=True):
+        self.user_movie_matrix = user_movie_matrix
+        ratings = user_movie_matrix.ratings.astype(np.float64)
+        self.global_mean = ratings.data.mean()
+        centered = ratings.copy()
+        centered.data -= self.global_mean
+        centered_t = centered.T.tocsr()
+        rng = np.random.default_rng(self.random_state)
+        n_users, n_movies = ratings.shape
+        self.user_factors = rng.normal(0, 0.1, (n_users, self.n_factors))
+        self.item_factors = rng.normal(0, 0.1, (n_movies, self.n_factors))
+        for iteration in range(self.n_iter):
+            start = time.time()
+            self.user_factors = self.solve(centered, self.item_factors)
+            self.item_factors = self.solve(centered_t, self.user_factors)
+            if verbose:
+                print(f"iteration {iteration + 1}/{self.n_iter}: train RMSE {self.rmse(ratings.tocoo()):.4f} "
+                      f"({time.time() - start:.1f}s)")
+        return self
+
+    def solve(self, ratings, fixed, block_size=4096, max_outer_size=5e7):
+        # Least squares factors for every row of ratings (CSR, centered) given the factors of its columns
+        n_rows, k = ratings.shape[0], fixed.shape[1]
+        counts = np.diff(ratings.indptr)
+        rhs = ratings @ fixed
+        reg = self.regularization * np.maximum(counts, 1)[:, None, None] * np.eye(k)
+        factors = np.empty((n_rows, k))
+        if fixed.shape[0] * k * k <= max_outer_size:
+            rated = ratings.copy()
+            rated.data[:] = 1
+            outer = (fixed[:, :, None] * fixed[:, None, :]).reshape(fixed.shape[0], k * k)
+            for start in range(0, n_rows, block_size):
+                end = min(start + block_size, n_rows)
+                gram = (rated[start:end] @ outer).reshape(end - start, k, k)
+                factors[start:end] = np.linalg.solve(gram + reg[start:end], rhs[start:end, :, None])[:, :, 0]
+        else:
+            for row in range(n_rows):
+                cols = ratings.indices[ratings.indptr[row]:ratings.indptr[row + 1]]
+                gram = fixed[cols].T @ fixed[cols]
+                factors[row] = np.linalg.solve(gram + reg[row], rhs[row])
+        return factors
+
+    def predict(self, user_codes, movie_codes):
+        return self.global_mean + np.einsum("ij,ij->i", self.user_factors[user_codes], self.item_factors[movie_codes])
+
+    def rmse(self, ratings, block_size=1000000):
+        # ratings: COO matrix or (user codes, movie codes, ratings) arrays
+        user_codes, movie_codes, values = (ratings.row, ratings.col, ratings.data) \
+            if hasattr(ratings, "row") else ratings
+        squared_error = 0.0
+        for start in range(0, len(values), block_size):
+            end = start + block_size
+            errors = self.predict(user_codes[start:end], movie_codes[start:end]) - values[start:end]
+            squared_error += (errors ** 2).sum()
+        return np.sqrt(squared_error / len(values))
+
+    def recommend_codes(self, user_code, n=10):
+        # One dot product against all movies, the watched ones excluded, then the top-n selection
+        scores = self.global_mean + self.item_factors @ self.user_factors[user_code]
+        scores[self.user_movie_matrix.watched_codes(user_code)] = -np.inf
+        n = min(n, len(scores))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top, scores[top]
+
+    def recommend(self, random_user, n=10):
+        # userIds and titles only at the API boundary
+        codes, scores = self.recommend_codes(self.user_movie_matrix.user_code(random_user), n)
+        return pd.Series(scores, index=pd.Index(self.user_movie_matrix.titles[codes], name="title"),
+                         name="predicted_rating")
+
+
+# Trained without the held-out ratings, evaluated in section 5
+als_train = ALSRecommender(n_factors=32, regularization=0.05, n_iter=10).fit(train_matrix)
+
+als_train.rmse(test_ratings)
+
+
+######################################
+# 4. Making Recommendations
+######################################
+
+random_user = int(pd.Series(user_movie_matrix.user_ids).sample(1, random_state=45).values[0])
+
+als_train.recommend(random_user, n=10)
+
+# The full model is (n_users + n_movies) x 32 float64, ~36 MB
+als = ALSRecommender(n_factors=32, regularization=0.05, n_iter=10).fit(user_movie_matrix)
+
+als.recommend(random_user, n=10)
+
+
+######################################
+# 5. Benchmark Against the Memory-Based Recommenders
+######################################
+
+# RMSE: ALS against the global mean and the movie means on the held-out ratings (the memory-based recommenders
+# rank movies but do not predict a rating on the 0.5 - 5 scale).
+# recall@n: for a sample of users, the share of their held-out movies rated >= relevant that show up in the
+# top-n list. Every recommender is a function user_code -> recommended movie codes trained on train_matrix;
+# the memory-based engines (collaborative_filtering.py) are adapted below.
+
+def baseline_rmse(train_matrix, test_ratings):
+    user_codes, movie_codes, values = test_ratings
+    ratings = train_matrix.ratings
+    global_mean = ratings.data.mean()
+    counts = ratings.getnnz(axis=0)
+    with np.errstate(invalid="ignore"):
+        movie_means = np.where(counts > 0, np.asarray(ratings.sum(axis=0)).ravel() / counts, global_mean)
+    return {"global_mean": np.sqrt(((values - global_mean) ** 2).mean()),
+            "movie_mean": np.sqrt(((values - movie_means[movie_codes]) ** 2).mean())}
+
+
+def item_based_user_recommender(item_engine, train_matrix):
+    # item_engine: ItemCorrelationEngine(train_matrix).
+    # The user's highest rated movie plays the role of the movie name passed to item_based_recommender.
+    def recommend_codes(user_code, n=10):
+        start, end = train_matrix.ratings.indptr[user_code], train_matrix.ratings.indptr[user_code + 1]
+        watched = train_matrix.ratings.indices[start:end]
+        favourite = watched[np.argmax(train_matrix.ratings.data[start:end])]
+        codes, _ = item_engine.neighbours(favourite, n + len(watched))
+        return codes[~np.isin(codes, watched)][:n]
+    return recommend_codes
+
+
+def user_based_user_recommender(user_based, train_matrix, ratio=60, cor_th=0.65):
+    # user_based: UserBasedRecommender(train_matrix, RatingStore.from_matrix(train_matrix), movie);
+    # every recommended movie is kept (score=0), ranked by weighted rating.
+    def recommend_codes(user_code, n=10):
+        scores = user_based.scores(train_matrix.user_ids[user_code], ratio, cor_th, score=0)
+        codes = np.searchsorted(train_matrix.movie_ids, scores["movieId"].to_numpy())
+        return codes[~np.isin(codes, train_matrix.watched_codes(user_code))][:n]
+    return recommend_codes
+
+
+def recall_at_n(recommenders, test_ratings, n=10, relevant=4.0, n_users=200, random_state=42):
+    user_codes, movie_codes, values = test_ratings
+    relevant_mask = values >= relevant
+    users = np.unique(user_codes[relevant_mask])
+    users = np.random.default_rng(random_state).choice(users, min(n_users, len(users)), replace=False)
+    results = []
+    for name, recommend_codes in recommenders.items():
+        hits, total, start = 0, 0, time.time()
+        for user_code in users:
+            held_out = movie_codes[relevant_mask & (user_codes == user_code)]
+            hits += np.isin(held_out, recommend_codes(user_code, n)).sum()
+            total += len(held_out)
+        results.append({"recommender": name,
+                        f"recall@{n}": hits / total,
+                        "ms_per_user": (time.time() - start) * 1000 / len(users)})
+    return pd.DataFrame(results)
+
+
+def popularity_recommender(train_matrix):
+    # Most rated movies the user has not watched yet: the floor any personalized recommender has to beat
+    popular = np.argsort(-train_matrix.ratings.getnnz(axis=0), kind="stable")
+
+    def recommend_codes(user_code, n=10):
+        watched = train_matrix.watched_codes(user_code)
+        candidates = popular[:n + len(watched)]
+        return candidates[~np.isin(candidates, watched)][:n]
+    return recommend_codes
+
+
+baseline_rmse(train_matrix, test_ratings), als_train.rmse(test_ratings)
+
+# The user-based engine only sees the training ratings of the common movies
+train_user_based = UserBasedRecommender(train_matrix, RatingStore.from_matrix(train_matrix), load_movies())
+
+recommenders = {"popularity": popularity_recommender(train_matrix),
+                "item_based": item_based_user_recommender(ItemCorrelationEngine(train_matrix), train_matrix),
+                "user_based": user_based_user_recommender(train_user_based, train_matrix),
+                "als": lambda user_code, n=10: als_train.recommend_codes(user_code, n)[0]}
+
+recall_at_n(recommenders, test_ratings, n=10)
@@ -0,0 +1,192 @@
+#############################
+# MovieLens User-Movie Matrix
+#############################
+
+# Shared by item_based_recommender.py and user_based_recommender.py.
+# pivot_table(index="userId", columns="title") builds a dense 138493 x 3159 float64 frame (~3.5 GB, mostly NaN).
+# Here the ratings go straight from integer-coded userId / movieId arrays into a scipy CSR matrix
+# (~17.8M stored ratings, a few hundred MB). A rating of 0 means "not rated": MovieLens ratings start at 0.5.
+# UserMovieMatrix answers the column, row and "rated by user" queries the recommenders need.
+# Internally everything is keyed by integer codes (row = user code, column = movie code); titles are only
+# translated through the titles array / title_codes dictionary at the API boundary.
+# Movies are identified by movieId, not by title: movie.csv has 27278 movies but 27262 distinct titles. The pivot
+# merged movies sharing a title into one column and counted their ratings together for the rare-movie filter;
+# here each movie is its own column and is filtered on its own count. A title shared by several movies gets its
+# movieId appended ("Hamlet (2000) (3598)"), so every movie can be looked up by its title.
+
+import os
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from title_search import TitleSearchIndex
+
+
+def unique_titles(titles, movie_ids):
+    titles = titles.copy()
+    duplicated = pd.Series(titles).duplicated(keep=False).to_numpy()
+    titles[duplicated] = [f"{title} ({movie_id})" for title, movie_id in zip(titles[duplicated], movie_ids[duplicated])]
+    return titles
+
+
+class UserMovieMatrix:
+    def __init__(self, ratings, user_ids, movie_ids, titles):
+        # ratings: (n_users, n_movies) CSR, user_ids / movie_ids: sorted ids of the rows / columns
+        self.ratings = ratings.tocsr()
+        self.user_ids = np.asarray(user_ids)
+        self.movie_ids = np.asarray(movie_ids)
+        self.titles = np.asarray(titles, dtype=object)
+        self.title_codes = {title: code for code, title in enumerate(self.titles)}
+        self.ratings_csc = None
+        self.title_search = TitleSearchIndex(self.titles)
+
+    @classmethod
+    def from_ratings(cls, user_ids, movie_ids, ratings, movie):
+        user_ids, user_codes = np.unique(np.asarray(user_ids), return_inverse=True)
+        movie_ids, movie_codes = np.unique(np.asarray(movie_ids), return_inverse=True)
+        matrix = csr_matrix((np.asarray(ratings, dtype=np.float32), (user_codes, movie_codes)),
+                            shape=(len(user_ids), len(movie_ids)))
+        titles = movie.set_index("movieId")["title"].reindex(movie_ids)
+        return cls(matrix, user_ids, movie_ids, unique_titles(titles.to_numpy(dtype=object), movie_ids))
+
+    @property
+    def shape(self):
+        return self.ratings.shape
+
+    @property
+    def columns(self):
+        return pd.Index(self.titles, name="title")
+
+    @property
+    def index(self):
+        return pd.Index(self.user_ids, name="userId")
+
+    def user_code(self, user_id):
+        code = np.searchsorted(self.user_ids, user_id)
+        if code == len(self.user_ids) or self.user_ids[code] != user_id:
+            raise KeyError(user_id)
+        return code
+
+    def movie_code(self, title):
+        return self.title_codes[title]
+
+    def column_codes(self, code):
+        # Column slices are cheap on the CSC copy, built on first use
+        if self.ratings_csc is None:
+            self.ratings_csc = self.ratings.tocsc()
+        start, end = self.ratings_csc.indptr[code], self.ratings_csc.indptr[code + 1]
+        return self.ratings_csc.indices[start:end], self.ratings_csc.data[start:end]
+
+    def search(self, keyword, limit=None):
+        # Codes of the movies whose title contains keyword (case-insensitive), best matches first
+        return self.title_search.search(keyword, limit)
+
+    def raters(self, codes):
+        # Users (row codes) who rated at least one of the given movies
+        return np.unique(np.concatenate([self.column_codes(code)[0] for code in codes]))
+
+    def __getitem__(self, title):
+        # Ratings of one movie, only for the users who rated it
+        users, ratings = self.column_codes(self.movie_code(title))
+        return pd.Series(ratings, index=pd.Index(self.user_ids[users], name="userId"), name=title)
+
+    def row(self, user_id):
+        code = self.user_code(user_id)
+        start, end = self.ratings.indptr[code], self.ratings.indptr[code + 1]
+        return pd.Series(self.ratings.data[start:end],
+                         index=pd.Index(self.titles[self.ratings.indices[start:end]], name="title"),
+                         name=user_id)
+
+    def watched_codes(self, user_code):
+        return self.ratings.indices[self.ratings.indptr[user_code]:self.ratings.indptr[user_code + 1]]
+
+    def movies_watched(self, user_id):
+        return self.titles[self.watched_codes(self.user_code(user_id))].tolist()
+
+    def watched_counts(self, codes):
+        # For every user (row code), how many of the given movies they rated
+        return self.ratings[:, codes].getnnz(axis=1)
+
+
+class RatingStore:
+    # All ratings (not only the common movies) sorted by userId, kept resident in memory.
+    # The ratings of user_ids[i] are movie_ids[offsets[i]:offsets[i + 1]] / ratings[offsets[i]:offsets[i + 1]],
+    # so the ratings of a set of users are a few slices instead of a merge over 20M rows.
+    def __init__(self, user_ids, offsets, movie_ids, ratings):
+        self.user_ids = user_ids
+        self.offsets = offsets
+        self.movie_ids = movie_ids
+        self.ratings = ratings
+
+    @classmethod
+    def from_ratings(cls, rating):
+        order = np.argsort(rating["userId"].to_numpy(), kind="stable")
+        user_ids, counts = np.unique(rating["userId"].to_numpy()[order], return_counts=True)
+        return cls(user_ids, np.concatenate([[0], np.cumsum(counts)]),
+                   rating["movieId"].to_numpy()[order], rating["rating"].to_numpy()[order])
+
+    @classmethod
+    def from_matrix(cls, user_movie_matrix):
+        # The ratings of a UserMovieMatrix (CSR rows are already grouped by user)
+        ratings = user_movie_matrix.ratings
+        return cls(user_movie_matrix.user_ids, ratings.indptr.astype(np.int64),
+                   user_movie_matrix.movie_ids[ratings.indices], ratings.data)
+
+    def user_ratings(self, user_ids):
+        # Returns, for every rating of the given users: position of the user in user_ids, movieId, rating
+        positions = np.searchsorted(self.user_ids, user_ids)
+        starts, ends = self.offsets[positions], self.offsets[positions + 1]
+        lengths = ends - starts
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.repeat(np.arange(len(positions)), lengths), self.movie_ids[rows], self.ratings[rows]
+
+
+#############################
+# Ingestion of rating.csv / movie.csv
+#############################
+
+# Reading rating.csv with default dtypes gives int64 ids, float64 ratings and an object timestamp, and merging it with
+# movie.csv repeats the title string on each of the 20M rows.
+# load_ratings reads int32 / float32 columns in chunks and skips the timestamp. A first pass over the movieId column
+# counts the ratings per movie, so rare movies are dropped chunk by chunk without any merge or value_counts.
+# The result is cached as a parquet file (pip install pyarrow), refreshed when rating.csv is newer.
+# Titles stay in movie.csv's own (movieId, title) table, one row per movie.
+
+RATING_DTYPES = {"userId": np.int32, "movieId": np.int32, "rating": np.float32}
+
+
+def load_ratings(rating_path='datasets/movie_lens_dataset/rating.csv', min_count=1000, cache_path=None,
+                 chunksize=2000000):
+    if cache_path is None:
+        cache_path = os.path.splitext(rating_path)[0] + f"_min{min_count}.parquet"
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(rating_path):
+        return pd.read_parquet(cache_path)
+
+    # First pass: number of ratings per movieId
+    counts = np.zeros(0, dtype=np.int64)
+    for chunk in pd.read_csv(rating_path, usecols=["movieId"], dtype=RATING_DTYPES, chunksize=chunksize):
+        chunk_counts = np.bincount(chunk["movieId"].to_numpy())
+        counts = np.pad(counts, (0, max(0, len(chunk_counts) - len(counts))))
+        counts[:len(chunk_counts)] += chunk_counts
+    common = counts > min_count
+
+    # Second pass: only the ratings of common movies
+    chunks = []
+    for chunk in pd.read_csv(rating_path, usecols=["userId", "movieId", "rating"], dtype=RATING_DTYPES,
+                             chunksize=chunksize):
+        chunks.append(chunk[common[chunk["movieId"].to_numpy()]])
+    rating = pd.concat(chunks, ignore_index=True)
+    rating.to_parquet(cache_path)
+    return rating
+
+
+def load_movies(movie_path='datasets/movie_lens_dataset/movie.csv'):
+    return pd.read_csv(movie_path, usecols=["movieId", "title"], dtype={"movieId": np.int32})
+
+
+def create_user_movie_matrix(movie_path='datasets/movie_lens_dataset/movie.csv',
+                             rating_path='datasets/movie_lens_dataset/rating.csv',
+                             min_count=1000):
+    # Rare movies are dropped on the integer movieId, before any title enters the picture
+    rating = load_ratings(rating_path, min_count)
+    return UserMovieMatrix.from_ratings(rating["userId"], rating["movieId"], rating["rating"],
+                                        load_movies(movie_path))
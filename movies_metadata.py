@@ -0,0 +1,43 @@
+#############################
+# movies_metadata.csv Loader
+#############################
+
+# Shared by content_based_recommender.py and sorting.py.
+# pd.read_csv(..., low_memory=False) parses all 24 columns, including long JSON-like strings such as
+# production_companies, while the scripts only use a few of them.
+# load_movies_metadata reads only the requested columns, chunk by chunk, coerces the malformed numeric rows
+# (a few rows have shifted fields, e.g. a date in "id") to NaN and caches the result as a parquet file,
+# so later runs skip the CSV parsing.
+
+# pip install pyarrow
+import os
+import pandas as pd
+
+NUMERIC_DTYPES = {"id": "Int64",
+                  "budget": "float64",
+                  "revenue": "float64",
+                  "popularity": "float32",
+                  "runtime": "float32",
+                  "vote_average": "float32",
+                  "vote_count": "float32"}
+
+
+def load_movies_metadata(path="datasets/the_movies_dataset/movies_metadata.csv",
+                         columns=("title", "overview", "vote_average", "vote_count"),
+                         cache_path=None, chunksize=10000):
+    columns = list(columns)
+    if cache_path is None:
+        cache_path = os.path.splitext(path)[0] + "_" + "_".join(columns) + ".parquet"
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        return pd.read_parquet(cache_path)
+
+    chunks = []
+    # Everything is read as text first: the malformed rows carry strings in numeric columns
+    for chunk in pd.read_csv(path, usecols=columns, dtype=str, chunksize=chunksize):
+        for col in columns:
+            if col in NUMERIC_DTYPES:
+                chunk[col] = pd.to_numeric(chunk[col], errors="coerce").astype(NUMERIC_DTYPES[col])
+        chunks.append(chunk[columns])
+    dataframe = pd.concat(chunks, ignore_index=True)
+    dataframe.to_parquet(cache_path)
+    return dataframe
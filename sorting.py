@@ -266,12 +266,11 @@ import math
 import scipy.stats as st
 pd.set_option('display.max_columns', None)
 pd.set_option('display.expand_frame_repr', False)
+from movies_metadata import load_movies_metadata
 pd.set_option('display.float_format', lambda x: '%.5f' % x)
 
-df = pd.read_csv("datasets/movies_metadata.csv",
-                 low_memory=False)  # To turn off DtypeWarning
-
-df = df[["title", "vote_average", "vote_count"]]
+df = load_movies_metadata("datasets/movies_metadata.csv",
+                          columns=["title", "vote_average", "vote_count"])
 
 df.head()
 #                          title  vote_average  vote_count
@@ -0,0 +1,75 @@
+#############################
+# Title Search Index
+#############################
+
+# Shared by item_based_recommender.py (check_film) and content_based_recommender.py.
+# check_film scanned every title with `keyword in col` on each call. TitleSearchIndex is built once:
+# - prefix search: the lower-cased titles are kept sorted, a prefix is a bisect range
+# - substring search: trigram -> sorted codes of the titles containing it; the posting lists of the keyword's
+#   trigrams are intersected and only the remaining candidates are checked with `in`
+# Keywords shorter than 3 characters (first keystrokes of an autocomplete box) use prefix search only.
+# Results are ranked: exact title, title prefix, word prefix, other substring, then shorter and alphabetical first.
+# Search results are codes, i.e. positions in the titles passed to the index.
+
+from bisect import bisect_left
+import numpy as np
+
+
+class TitleSearchIndex:
+    def __init__(self, titles):
+        self.titles = np.asarray(titles, dtype=object)
+        self.lowered = [title.casefold() if isinstance(title, str) else "" for title in self.titles]
+        self.lengths = np.array([len(title) for title in self.lowered], dtype=np.int64)
+        self.sorted_codes = np.array(sorted(range(len(self.lowered)), key=self.lowered.__getitem__), dtype=np.int64)
+        self.sorted_titles = [self.lowered[code] for code in self.sorted_codes]
+        self.alphabetical_rank = np.empty(len(self.lowered), dtype=np.int64)
+        self.alphabetical_rank[self.sorted_codes] = np.arange(len(self.lowered))
+        postings = {}
+        for code, title in enumerate(self.lowered):
+            for trigram in {title[i:i + 3] for i in range(len(title) - 2)}:
+                postings.setdefault(trigram, []).append(code)
+        self.trigrams = {trigram: np.array(codes, dtype=np.int64) for trigram, codes in postings.items()}
+
+    def prefix(self, keyword):
+        keyword = keyword.casefold()
+        start = bisect_left(self.sorted_titles, keyword)
+        end = bisect_left(self.sorted_titles, keyword + "\U0010ffff", start)
+        return self.sorted_codes[start:end]
+
+    def candidates(self, keyword):
+        # Titles containing every trigram of the keyword, rarest trigram first
+        postings = sorted((self.trigrams.get(keyword[i:i + 3], np.array([], dtype=np.int64))
+                           for i in range(len(keyword) - 2)), key=len)
+        candidates = postings[0]
+        for posting in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        return candidates
+
+    def search(self, keyword, limit=None):
+        keyword = keyword.casefold()
+        if not keyword:
+            return np.array([], dtype=np.int64)
+        if len(keyword) < 3:
+            codes = self.prefix(keyword)
+            positions = np.zeros(len(codes), dtype=np.int64)
+            word_starts = np.ones(len(codes), dtype=bool)
+        else:
+            codes, positions, word_starts = [], [], []
+            for code in self.candidates(keyword):
+                position = self.lowered[code].find(keyword)
+                if position >= 0:
+                    codes.append(code)
+                    positions.append(position)
+                    word_starts.append(position == 0 or not self.lowered[code][position - 1].isalnum())
+            codes = np.array(codes, dtype=np.int64)
+            positions = np.array(positions, dtype=np.int64)
+        exact = self.lengths[codes] == len(keyword)
+        # np.lexsort sorts by the last key first
+        order = np.lexsort((self.alphabetical_rank[codes], self.lengths[codes], ~np.array(word_starts, dtype=bool),
+                            positions != 0, ~exact))
+        return codes[order][:limit]
+
+    def search_titles(self, keyword, limit=None):
+        return self.titles[self.search(keyword, limit)].tolist()
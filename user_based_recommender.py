@@ -5,6 +5,7 @@
 #############################################
 # Step 1: Preparation of the Data Set
 #############################################
+import numpy as np
 import pandas as pd
 pd.set_option('display.max_columns', None)
 pd.set_option('display.width', 500)
@@ -153,28 +154,35 @@ user_movie_df = create_user_movie_df()
 
 def user_based_recommender(random_user, user_movie_df, ratio=60, cor_th=0.65, score=3.5):
     import pandas as pd
-    random_user_df = user_movie_df[user_movie_df.index == random_user]
-    movies_watched = random_user_df.columns[random_user_df.notna().any()].tolist()
-    movies_watched_df = user_movie_df[movies_watched]
-    user_movie_count = movies_watched_df.T.notnull().sum()
-    user_movie_count = user_movie_count.reset_index()
-    user_movie_count.columns = ["userId", "movie_count"]
-    perc = len(movies_watched) * ratio / 100
-    users_same_movies = user_movie_count[user_movie_count["movie_count"] > perc]["userId"]
-
-    final_df = pd.concat([movies_watched_df[movies_watched_df.index.isin(users_same_movies)],
-                          random_user_df[movies_watched]])
-
-    corr_df = final_df.T.corr().unstack().sort_values().drop_duplicates()
-    corr_df = pd.DataFrame(corr_df, columns=["corr"])
-    corr_df.index.names = ['user_id_1', 'user_id_2']
-    corr_df = corr_df.reset_index()
-
-    top_users = corr_df[(corr_df["user_id_1"] == random_user) & (corr_df["corr"] >= cor_th)][
-        ["user_id_2", "corr"]].reset_index(drop=True)
-
-    top_users = top_users.sort_values(by='corr', ascending=False)
-    top_users.rename(columns={"user_id_2": "userId"}, inplace=True)
+    # Resident recommender (Step 9): no CSV is read per request
+    if hasattr(user_movie_df, "recommend"):
+        return user_movie_df.recommend(random_user, ratio, cor_th, score)
+    if hasattr(user_movie_df, "ratings"):
+        # Sparse UserMovieMatrix (Step 7): only the target user's correlations are computed (Step 8)
+        top_users = find_top_users(user_movie_df, random_user, ratio, cor_th)
+    else:
+        random_user_df = user_movie_df[user_movie_df.index == random_user]
+        movies_watched = random_user_df.columns[random_user_df.notna().any()].tolist()
+        movies_watched_df = user_movie_df[movies_watched]
+        user_movie_count = movies_watched_df.T.notnull().sum()
+        user_movie_count = user_movie_count.reset_index()
+        user_movie_count.columns = ["userId", "movie_count"]
+        perc = len(movies_watched) * ratio / 100
+        users_same_movies = user_movie_count[user_movie_count["movie_count"] > perc]["userId"]
+
+        final_df = pd.concat([movies_watched_df[movies_watched_df.index.isin(users_same_movies)],
+                              random_user_df[movies_watched]])
+
+        corr_df = final_df.T.corr().unstack().sort_values().drop_duplicates()
+        corr_df = pd.DataFrame(corr_df, columns=["corr"])
+        corr_df.index.names = ['user_id_1', 'user_id_2']
+        corr_df = corr_df.reset_index()
+
+        top_users = corr_df[(corr_df["user_id_1"] == random_user) & (corr_df["corr"] >= cor_th)][
+            ["user_id_2", "corr"]].reset_index(drop=True)
+
+        top_users = top_users.sort_values(by='corr', ascending=False)
+        top_users.rename(columns={"user_id_2": "userId"}, inplace=True)
     rating = pd.read_csv('datasets/movie_lens_dataset/rating.csv')
     top_users_ratings = top_users.merge(rating[["userId", "movieId", "rating"]], how='inner')
     top_users_ratings['weighted_rating'] = top_users_ratings['corr'] * top_users_ratings['rating']
@@ -192,3 +200,80 @@ random_user = int(pd.Series(user_movie_df.index).sample(1).values)
 user_based_recommender(random_user, user_movie_df, cor_th=0.70, score=4)
 
 
+#############################################
+# Step 7: Sparse User Movie Matrix
+#############################################
+
+# The pivot_table above is a dense 138493 x 3159 float64 frame (~3.5 GB, mostly NaN).
+# create_user_movie_matrix keeps the same ratings in a sparse CSR matrix built from the integer ids.
+from movie_lens import create_user_movie_matrix
+
+user_movie_matrix = create_user_movie_matrix()
+
+user_movie_matrix.shape
+
+# Users and movies are integer codes (rows / columns of the matrix); userIds and titles only at the boundary
+random_user = 41531
+random_user_code = user_movie_matrix.user_code(random_user)
+movies_watched = user_movie_matrix.watched_codes(random_user_code)
+
+len(movies_watched)
+
+user_movie_count = user_movie_matrix.watched_counts(movies_watched)
+users_same_movies = np.flatnonzero(user_movie_count > len(movies_watched) * 60 / 100)
+
+user_movie_matrix.user_ids[users_same_movies]
+
+
+#############################################
+# Step 8: Finding Similar Users Without the User-User Correlation Matrix
+#############################################
+
+# final_df.T.corr() correlates every candidate user with every other one (up to ~100k x 100k) and then keeps
+# a single row of it. Only the target user's row is needed: over the movies the target watched, the
+# pairwise-complete Pearson correlation with every candidate comes from a few sparse mat-vec products
+# (co-rated counts, sums, sums of squares and cross sums), so memory is linear in the number of candidates.
+# user_correlations and find_top_users live in collaborative_filtering.py.
+from collaborative_filtering import find_top_users
+
+find_top_users(user_movie_matrix, random_user, cor_th=0.65)
+
+user_based_recommender(random_user, user_movie_matrix, cor_th=0.70, score=4)
+
+
+#############################################
+# Step 9: Keeping the Rating Data Resident
+#############################################
+
+# user_based_recommender reads rating.csv (20M rows) and movie.csv again on every call and merges the top users
+# with all ratings. UserBasedRecommender loads them once: the ratings go into a RatingStore (sorted by userId
+# with per-user offsets, see movie_lens.py), so the ratings of the top users are a few array slices.
+# The scoring tail (corr * rating column, groupby("movieId").mean(), filter, sort, merge with movie.csv) is
+# array operations only: the top users' ratings form a sparse (n_top_users, n_movies) matrix R, the weighted
+# rating of every movie is (R^T corr) / (number of top users who rated it), the same mean as the groupby,
+# followed by a top-n selection and a title lookup in the resident titles array (indexed by movie code).
+from collaborative_filtering import UserBasedRecommender
+
+user_based = UserBasedRecommender(user_movie_matrix)
+
+user_based_recommender(random_user, user_based, cor_th=0.70, score=4)
+
+user_based.recommend(random_user, cor_th=0.70, score=4, n=5)
+
+
+#############################################
+# Step 10: Batch Recommendations for All Users
+#############################################
+
+# Precomputed recommendations for all users. The sparse rating matrix and the RatingStore arrays are copied
+# once into shared memory; every worker process maps them read-only instead of receiving its own copy.
+# Users are split into chunks, every chunk is written to its own part file (output_dir/part-00000.parquet, ...),
+# first to a hidden temporary file (.part-00000.parquet.tmp) and then renamed, so a part file only exists once its
+# chunk is complete.
+# Running the job again skips the chunks that already have a part file: a crashed shard does not restart the job.
+# The job runs from collaborative_filtering.py, not from this script:
+#   python collaborative_filtering.py
+# Under spawn / forkserver (macOS, Windows, Python 3.14 on Linux) the workers import the main module: launched from
+# this script, each of them would first redo every step above (the dense pivot_table, the 20M-row read_csv calls).
+# Once it has run, the part files read back as one frame:
+#   pd.read_parquet("outputs/user_based_recommendations")